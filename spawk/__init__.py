@@ -7,8 +7,8 @@ __license__ = 'MIT'
 __all__ = []
 
 from .input import (  # noqa: W0611
-    FileFollower,)
+    FileFollower, BlockLineReader, MmapLineIterator,)
 from .engine import (  # noqa: W0611
     Spawk, Continue,)
 from .objects import (  # noqa: W0611
-    Context,)
+    Context, StringSink,)
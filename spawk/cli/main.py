@@ -1,29 +1,75 @@
 #!/usr/bin/env python3
 
+import io
 import sys
 import click
 from functools import update_wrapper
 import itertools
+import os
+
+from ..input import BlockLineReader, MmapLineIterator
+from ..internal import _write_bytes
 
 @click.group(chain=True)
-def cli():
+@click.option(
+    '--line-buffered/--no-line-buffered', default=False,
+    help='Flush the output after every line, for watching live streams'
+)
+def cli(line_buffered):
     '''The main help
     '''
 
 @cli.result_callback()
-def process_commands(processors):
+def process_commands(processors, line_buffered):
     '''This result callback is involked with an iterable of all the chained subcommands.
     As in this example eace subcommand returns a function we can chain them together to feed
     one into the other, similar to how a pipe on unix works.
+
+    The output is written through a 64KB buffer, unless line buffering was requested.
+    Streams of bytes, from "input --bytes", are written to the binary stdout undecoded.
     '''
     stream = ()
 
-    for processor in processors:
+    for processor in fuse_mappers(processors):
         stream = processor(stream)
 
-    if stream is not None:
+    if stream is None:
+        return
+
+    stream = iter(stream)
+    first = next(stream, None)
+    if first is None:
+        return
+    stream = itertools.chain([first], stream)
+    binary = isinstance(first, bytes)
+
+    #  A replaced sys.stdout, such as an io.StringIO(), may have no buffer
+    #  to wrap, so it is written to directly.
+    buffer = getattr(sys.stdout, 'buffer', None)
+    if line_buffered or buffer is None:
+        out = buffer if binary and buffer is not None else sys.stdout
+        write = _write_bytes if binary and buffer is None else out.write
         for _ in stream:
-            sys.stdout.write(_)
+            write(_)
+            if line_buffered:
+                out.flush()
+        return
+
+    sys.stdout.flush()
+    out = io.BufferedWriter(buffer, 65536)
+    if not binary:
+        out = io.TextIOWrapper(
+            out, encoding=sys.stdout.encoding, errors=sys.stdout.errors)
+    try:
+        write = out.write
+        for _ in stream:
+            write(_)
+    finally:
+        out.flush()
+        out = out.detach()
+        if not binary:
+            out.detach()
+        buffer.flush()
 
 def processor(f):
     '''Helper decorator to rewrite a function so that it returns another function from it.'''
@@ -33,6 +79,44 @@ def processor(f):
         return processor
     return update_wrapper(new_func, f)
 
+def mapper(f):
+    '''Similar to the :func:`processor` but for stages that transform each item on its
+    own.  The decorated function is called with each item and returns the new item.  The
+    per-item functions are kept on the processor so that :func:`fuse_mappers` can combine
+    adjacent map stages.'''
+    def new_func(*args, **kwargs):
+        if args or kwargs:
+            return map_processor([lambda x: f(x, *args, **kwargs)])
+        return map_processor([f])
+    return update_wrapper(new_func, f)
+
+def map_processor(funcs):
+    '''Build a processor that applies each of the per-item functions in turn.  The calls
+    are compiled into a single function so each item costs one call per function and the
+    stage is a plain C-level map() over the stream.'''
+    namespace = {'f%d' % i: f for i, f in enumerate(funcs)}
+    body = 'x'
+    for i in range(len(funcs)):
+        body = 'f%d(%s)' % (i, body)
+    item_func = eval('lambda x: ' + body, namespace)
+
+    def processor(stream):
+        return map(item_func, stream)
+    processor._spawk_map = tuple(funcs)
+    return processor
+
+def fuse_mappers(processors):
+    '''Combine runs of adjacent map stages into one stage, so each item passes through
+    a single map() rather than a chain of generators.'''
+    fused = []
+    for processor in processors:
+        funcs = getattr(processor, '_spawk_map', None)
+        if funcs is not None and fused and hasattr(fused[-1], '_spawk_map'):
+            fused[-1] = map_processor(fused[-1]._spawk_map + funcs)
+        else:
+            fused.append(processor)
+    return fused
+
 def generator(f):
     '''Similar to the :func:`processor` but passes through old values unchanged and does not
     pass through the values as parameter'''
@@ -56,25 +140,30 @@ def generator(f):
         'reading the new file'
 
 )
+@click.option(
+    '--bytes/--no-bytes', 'binary', default=False,
+    help='Read the lines as undecoded bytes, faster for ASCII input such as logs'
+)
 @generator
-def input_cmd(filename, state_file, follow):
-    with open(filename, 'r') as fp:
-        for line in fp:
-            yield line
+def input_cmd(filename, state_file, follow, binary):
+    if not state_file and not follow and os.path.isfile(filename):
+        yield from MmapLineIterator(filename, encoding=None if binary else 'utf-8')
+        return
+
+    with open(filename, 'rb' if binary else 'r') as fp:
+        yield from BlockLineReader(fp)
 
 
 @cli.command('upper')
-@processor
-def upper_cmd(stream):
-    for x in stream:
-        yield x.upper()
+@mapper
+def upper_cmd(x):
+    return x.upper()
 
 
 @cli.command('lower')
-@processor
-def lower_cmd(stream):
-    for x in stream:
-        yield x.lower()
+@mapper
+def lower_cmd(x):
+    return x.lower()
 
 
 @cli.command('slice')
@@ -99,8 +188,13 @@ def head_cmd(stream, lines):
 @click.argument('filename')
 @processor
 def tee_cmd(stream, filename):
-    with open(filename, 'w') as fp:
-        for x in stream:
+    stream = iter(stream)
+    first = next(stream, None)
+    if first is None:
+        open(filename, 'w').close()
+        return
+    with open(filename, 'wb' if isinstance(first, bytes) else 'w') as fp:
+        for x in itertools.chain([first], stream):
             fp.write(x)
             yield(x)
 
@@ -109,7 +203,10 @@ def tee_cmd(stream, filename):
 @processor
 def output_cmd(stream):
     for x in stream:
-        sys.stdout.write(x)
+        if isinstance(x, bytes):
+            _write_bytes(x)
+        else:
+            sys.stdout.write(x)
 
 
 @cli.command('less')
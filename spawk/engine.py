@@ -1,21 +1,41 @@
 #!/usr/bin/env python3
 # vim: ts=4 sw=4 ai et
 
-from .internal import _print
-from .objects import Context
+from .internal import (
+    _print, _write_bytes, _compile_predicate, _takes_match, _is_literal,
+    _alternation, _search, _grep_predicate, _encode, _parallel_grep,
+    _parallel_grep_mapped, _compile_driver, _check_backend, _regex_backend,
+    RawLineIterator, _grep_buffer, _grep_mmap)
+from .input import BlockLineReader, MmapLineIterator
+from .objects import Context, String, Bytes, Range
 from .parser.line import LineRecords
 from .parser import AbstractRecords
-import re
+import collections
+import concurrent.futures
+import io
+import itertools
+import os
+#  eval() expressions are run with this module's globals, so "re" is
+#  available to them as it always has been.
+import re  # noqa: F401
 import sys
 
 import enum
 
+try:
+    import pyarrow
+    import pyarrow.compute
+except ImportError:
+    pyarrow = None
+
 class ControlFlow(enum.Flag):
     '''Control flow: Flags for modifying engine control flow.
 
     Continue: Stop processing this record and continue with next.
     When returned from a pipeline member, this causes further parts of the
-    pipeline not to be called on this record.
+    pipeline not to be called on this record.  It is only meaningful as
+    the return value of a rule; input records that should be skipped are
+    dropped with grep() or a filter on the input instead.
 
     Example:
 
@@ -46,39 +66,250 @@ class Spawk:
             if context.range.is_last_line:
                 print(context.data)
                 context.data = ''
+
+    If "binary" is true, the input is read as bytes and not decoded: the
+    lines are Bytes() objects and str patterns are encoded to match them.
+    This is faster for ASCII-dominated input such as logs.
+
+    :param in_records: Input file or records, or the name of a file which
+            is read by memory mapping it, (Default: sys.stdin)
+    :param binary: (bool) Process the input as bytes.  A file given as the
+            input must be opened in binary mode.
+    :param buffered: (bool) Collect the lines printed by rules that have
+            no function, such as "t.pattern('match')()", and write them
+            to stdout in 64KB blocks and at the end of run().
+    :param regex_backend: Module used for the regular expressions: "re",
+            "re2" (linear-time matching, patterns it can't handle use
+            "re"), "regex", or "auto" (re2 if it is installed).  (Default:
+            the SPAWK_REGEX_BACKEND environment variable, or "re")
     '''
-    def __init__(self, in_records=None):
+    def __init__(
+            self, in_records=None, binary=False, buffered=False,
+            regex_backend=None):
+        if regex_backend is not None:
+            _check_backend(regex_backend)
         if in_records is None:
-            in_records = LineRecords(sys.stdin)
+            in_records = sys.stdin.buffer if binary else sys.stdin
+        if isinstance(in_records, (str, os.PathLike)):
+            in_records = MmapLineIterator(
+                in_records, encoding=None if binary else 'utf-8')
         if not isinstance(in_records, AbstractRecords):
-            in_records = LineRecords(in_records)
+            in_records = LineRecords(in_records, binary=binary)
 
+        self.binary = binary
+        self.buffered = buffered
+        self.regex_backend = regex_backend
+        self._output = None
         self.input = in_records
+        self._records = in_records
+        self._ops = []
+        self._ops_input = in_records
         self.begin_handlers = []
         self.main_handlers = []
         self.context = Context()
 
     def __iter__(self):
-        return self.input
+        return iter(self.input)
 
     def run(self):
         '''
         Run the processor.  This consumes the data in the input and
         runs any rules defined for processing that data.
         '''
+        context = self.context
         for f in self.begin_handlers:
-            f(self.context)
+            f(context)
         self.begin_handlers = []
 
-        for line in self.input:
-            if line is Continue:
-                continue
-            for handler in self.main_handlers:
-                ret = handler(self.context, line)
-                if ret is Continue:
-                    break
-                if ret is not None:
-                    line = ret
+        #  A pipeline of grep() and split() stages on a file is run by
+        #  the generated driver itself, rather than through a generator
+        #  per stage.  A grep() of an in-memory buffer or mapped file is
+        #  left to search the whole input at once.
+        records = self._records
+        ops = self._ops
+        if (ops and self.input is self._ops_input
+                and isinstance(records, LineRecords)
+                and all(op[0] in ('grep', 'split') for op in ops)
+                and not (ops[0][0] == 'grep' and self._whole_input())):
+            self._run_lines(records, ops)
+        else:
+            self._run_lines(self.input)
+
+    @classmethod
+    def from_path(cls, path, binary=False, buffered=False, regex_backend=None):
+        '''
+        Create a processor reading the file at "path" by memory mapping
+        it.  A grep() as the first stage of the pipeline searches the
+        whole mapped file rather than each line, so lines that don't
+        match are never copied out of it.  Without "binary", this is
+        done only for patterns that are plain strings.
+
+        Example:
+
+            t = spawk.Spawk.from_path('/var/log/syslog', binary=True)
+            t.grep(r'sshd\[\d+\]')
+
+        :param path: Name of the file, a str or PathLike.
+        :param binary: (bool) Process the input as bytes.
+        :param buffered: (bool) As for Spawk().
+        :param regex_backend: As for Spawk().
+        '''
+        return cls(
+            os.fspath(path), binary=binary, buffered=buffered,
+            regex_backend=regex_backend)
+
+    def run_parallel(self, workers=None, chunksize=64 << 10):
+        '''
+        Run the processor, like run(), matching the grep() filters in a
+        pool of worker processes.  The input is read in batches of about
+        "chunksize" characters which are sent to the workers, and the
+        lines that pass the filters are handed to the rules in this
+        process in their original order.  A memory mapped file input (a
+        filename, or Spawk.from_path()) is instead cut into segments at
+        newlines, and each worker reads its segments from the file
+        itself, so only the matching lines are sent between processes.
+
+        This only helps when the grep() filters reject most of the input.
+        It is used only if the pipeline is built from grep(),
+        grep_batched() and split() on a file input, otherwise this is the
+        same as run().
+
+        :param workers: Number of worker processes (Default: the number
+                of CPUs).
+        :param chunksize: (int) Approximate number of characters in each
+                batch of lines sent to a worker.  Segments of a mapped
+                file are at least this many bytes, and larger for big
+                files.
+        '''
+        greps = tuple(
+            op[1] for op in self._ops if op[0] in ('grep', 'grep_batched'))
+        if (not greps or self.input is not self._ops_input
+                or not isinstance(self._records, LineRecords)):
+            return self.run()
+
+        context = self.context
+        for f in self.begin_handlers:
+            f(context)
+        self.begin_handlers = []
+
+        splits = [op for op in self._ops if op[0] == 'split']
+        cls = Bytes if self.binary else String
+        data = self._records.in_fileobj
+        if hasattr(data, 'seekable') and data.seekable():
+            data = BlockLineReader(data)
+        workers = workers or os.cpu_count() or 1
+        backend = self.regex_backend
+
+        def results(executor, jobs):
+            #  Keep a bounded number of jobs in flight, so the input is
+            #  not read far ahead of the rules.
+            pending = collections.deque()
+            limit = 2 * workers
+            for job in jobs:
+                pending.append(executor.submit(*job))
+                if len(pending) >= limit:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+        def batches():
+            batch = []
+            size = 0
+            for item in RawLineIterator(data):
+                batch.append(item)
+                size += len(item[1])
+                if size >= chunksize:
+                    yield _parallel_grep, greps, batch, backend
+                    batch = []
+                    size = 0
+            if batch:
+                yield _parallel_grep, greps, batch, backend
+
+        def lines(executor):
+            for matched in results(executor, batches()):
+                yield from matched
+
+        def segments():
+            size = os.path.getsize(data.filename)
+            step = max(chunksize, size // (workers * 8))
+            with open(data.filename, 'rb') as fp:
+                start = 0
+                while start < size:
+                    fp.seek(min(start + step, size) - 1)
+                    end = fp.tell() + len(fp.readline())
+                    yield (
+                        _parallel_grep_mapped, greps, data.filename,
+                        start, end, data.encoding, backend)
+                    start = end
+
+        def mapped_lines(executor):
+            base = 0
+            for matched, count in results(executor, segments()):
+                for lineno, line in matched:
+                    yield base + lineno, line
+                base += count
+
+        if isinstance(data, MmapLineIterator):
+            produce = mapped_lines
+        else:
+            produce = lines
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            matched = (cls(line, lineno) for lineno, line in produce(executor))
+            self._run_lines(matched, splits[-1:])
+
+    def _run_lines(self, lines, stages=()):
+        '''
+        INTERNAL: Run the main handlers over each of the lines.
+
+        :param stages: Recorded grep() and split() stages to apply to the
+                lines before the handlers.
+        '''
+        context = self.context
+
+        #  The handlers can't change during the run, so the loop over them
+        #  is generated as a single function specialized to this pipeline.
+        try:
+            with _regex_backend(self.regex_backend):
+                drive = _compile_driver(self.main_handlers, stages)
+            drive(context, lines)
+        finally:
+            self._flush_output()
+
+    def _default_action(self):
+        '''
+        INTERNAL: The function used by decorators called with no function,
+        which prints the line.  With "buffered", the lines are collected
+        in memory and written out when 64KB has built up and at the end
+        of the run.
+        '''
+        if not self.buffered:
+            return _print
+        if self._output is None:
+            self._output = io.BytesIO() if self.binary else io.StringIO()
+        output = self._output
+        write = output.write
+        tell = output.tell
+        flush = self._flush_output
+
+        def buffered_print(context, line):
+            write(line)
+            if tell() >= 65536:
+                flush()
+        return buffered_print
+
+    def _flush_output(self):
+        '''
+        INTERNAL: Write out the lines collected by buffered printing.
+        '''
+        output = self._output
+        if output is None or not output.tell():
+            return
+        if self.binary:
+            _write_bytes(output.getvalue())
+        else:
+            sys.stdout.write(output.getvalue())
+        output.seek(0)
+        output.truncate()
 
     def begin(self):
         '''
@@ -116,8 +347,10 @@ class Spawk:
     def split(self, sep=None, maxsplit=-1):
         '''
         Add a "fields" attribute to the line objects, as str.split().
-        The input lines are split into a list, and stored in the "fields"
-        attribute of the String().
+        The "fields" attribute of the String() is the line split into a
+        list.  It is split the first time it is used, so lines that are
+        filtered out or whose fields are never used are not split, and
+        "line.field(i)" splits only as far as field "i".
 
         :param sep: String to split on, as with str.split() (Default: None)
         :param maxsplit: Maximum number of splits to do as with str.split()
@@ -126,11 +359,20 @@ class Spawk:
                 pipeline of processors.
         '''
         def inner(data, sep, maxsplit):
+            split = (sep, maxsplit)
             for line in data:
-                line.fields = line.split(sep, maxsplit)
+                line._split = split
+                try:
+                    #  Drop fields split by an earlier stage.
+                    del line.fields
+                except AttributeError:
+                    pass
                 yield line
 
+        sep = _encode(sep, self.binary)
+        previous = self.input
         self.input = inner(self.input, sep, maxsplit)
+        self._record_op(previous, 'split', sep, maxsplit)
         return self
 
     def grep(self, *args):
@@ -139,21 +381,123 @@ class Spawk:
 
         :param *args: Regular expression to match, if multiple arguments are
                 given then the matches are combined as in an "or" (if any
-                match).
+                match).  The patterns are joined into a single alternation
+                so each line is searched only once, and patterns with no
+                regex special characters are matched as plain strings.
+                If this is the first stage of the pipeline and the input
+                is a StringIO, BytesIO or memory mapped file, the whole
+                input is searched at once rather than line by line.
+                With no patterns, no lines match.
         :rtype: Returns a reference to self, can be used to build up a
                 pipeline of processors.
         '''
+        whole_input = self.input is self._records and self._whole_input()
+
         def inner(data, *args):
-            rxlist = [re.compile(x).search for x in args]
-            for line in data:
-                for rx in rxlist:
-                    match = rx(line)
-                    if match:
+            backend = self.regex_backend
+            if whole_input:
+                source = self._records.in_fileobj
+                if isinstance(source, MmapLineIterator):
+                    with _regex_backend(backend):
+                        lines = _grep_mmap(
+                            source.filename, args, source.encoding)
+                else:
+                    cls = Bytes if self.binary else String
+                    buf = source.getvalue()[source.tell():]
+                    with _regex_backend(backend):
+                        lines = _grep_buffer(buf, args, cls)
+                    if lines is not None:
+                        source.seek(0, 2)
+                if lines is not None:
+                    yield from lines
+                    return
+
+            if len(args) == 1 and _is_literal(args[0]):
+                literal = args[0]
+                for line in data:
+                    if literal in line:
                         yield line
+                return
 
+            with _regex_backend(backend):
+                predicate = _grep_predicate(args)
+            yield from filter(predicate, data)
+
+        args = [_encode(x, self.binary) for x in args]
+        previous = self.input
         self.input = inner(self.input, *args)
+        self._record_op(previous, 'grep', tuple(args))
         return self
 
+    def grep_batched(self, *args, batch=4096):
+        '''
+        Adds a pattern matcher filter to the processor, like grep(), that
+        matches lines in batches.  If the "pyarrow" module is installed,
+        each batch of lines is matched by a single call to its vectorized
+        regex kernel.  Otherwise, or if the input is binary, this behaves
+        exactly like grep().
+
+        Note that pyarrow uses RE2 regular expression syntax, which does
+        not support backreferences or lookaround, and that no lines are
+        produced until a full batch has been read.  This is intended for
+        bulk processing of files, not following live input.
+
+        :param *args: Regular expression to match, if multiple arguments are
+                given then the matches are combined as in an "or" (if any
+                match).
+        :param batch: (int) Number of lines to match at a time.
+        :rtype: Returns a reference to self, can be used to build up a
+                pipeline of processors.
+        '''
+        pattern = '|'.join('(?:%s)' % x for x in args)
+        args = [_encode(x, self.binary) for x in args]
+
+        def inner(data, pattern, batch):
+            if pyarrow is None or self.binary or not args:
+                with _regex_backend(self.regex_backend):
+                    search = _alternation(args)
+                yield from filter(search, data)
+                return
+
+            match = pyarrow.compute.match_substring_regex
+            string = pyarrow.string()
+            data = iter(data)
+            while True:
+                lines = list(itertools.islice(data, batch))
+                if not lines:
+                    break
+                mask = match(pyarrow.array(lines, string), pattern)
+                yield from itertools.compress(lines, mask.to_pylist())
+
+        previous = self.input
+        self.input = inner(self.input, pattern, batch)
+        self._record_op(previous, 'grep_batched', tuple(args))
+        return self
+
+    def _whole_input(self):
+        '''
+        INTERNAL: Can the input be searched as a whole, rather than line
+        by line?  True for in-memory file objects and mapped files.
+        '''
+        records = self._records
+        return isinstance(records, LineRecords) and (
+            hasattr(records.in_fileobj, 'getvalue')
+            or isinstance(records.in_fileobj, MmapLineIterator))
+
+    def _record_op(self, previous, *op):
+        '''
+        INTERNAL: Remember a pipeline stage for run_parallel().  If the
+        input has been changed other than by a recorded stage, the
+        pipeline can't be rebuilt in the workers.
+
+        :param previous: The input the stage was added on to.
+        '''
+        if previous is not self._ops_input:
+            self._ops_input = None
+            return
+        self._ops.append(op)
+        self._ops_input = self.input
+
     ############
     #  DECORATOR
     ############
@@ -175,26 +519,50 @@ class Spawk:
     def pattern(self, pattern):
         '''
         Decorator for functions that are run when the pattern is matched.
+        The match object is stored in "context.regex", or if the decorated
+        function takes a third argument, it is passed the match directly
+        and the context is left alone.
+        Patterns that are plain strings are found with str.find() rather
+        than the regex engine, and their match objects have no groups.
 
         Example:
 
             @tc.pattern(r'hello\s+(\S+)')
             def hello(context, line):
-                context.hello = line.regex.group(1)
+                context.hello = context.regex.group(1)
+
+            @tc.pattern(r'goodbye\s+(\S+)')
+            def goodbye(context, line, m):
+                context.goodbye = m.group(1)
+
+        To collect the matching lines in a string, accumulate them in a
+        StringSink() with "+=".
 
         :param pattern: Regular expression pattern which, when matched,
                 triggers the decorated function.
         '''  # noqa: W605
-        rx = re.compile(pattern)
-
-        def inner(f=_print):
-            def wrapper(context, line):
-                m = rx.search(line)
-                if m:
-                    self.context.regex = m
-                    ret = f(context, line)
-                    del(self.context.regex)
-                    return ret
+        pattern = _encode(pattern, self.binary)
+        with _regex_backend(self.regex_backend):
+            rx_search = _search(pattern)
+
+        def inner(f=None):
+            if f is None:
+                f = self._default_action()
+            if _takes_match(f):
+                def wrapper(context, line):
+                    m = rx_search(line)
+                    if m:
+                        return f(context, line, m)
+                wrapper._spawk_inline = (
+                    'pattern', rx_search, f, True, pattern)
+            else:
+                def wrapper(context, line):
+                    m = rx_search(line)
+                    if m:
+                        context.regex = m
+                        return f(context, line)
+                wrapper._spawk_inline = (
+                    'pattern', rx_search, f, False, pattern)
             self.main_handlers.append(wrapper)
             return f
         return inner
@@ -205,63 +573,67 @@ class Spawk:
         decorated function for every line between (and including) the
         patterns.
 
-        The context object includes a "range" attribute, itself a Context()
-        which exists for the life of the range processing and includes
+        The context object includes a "range" attribute, a Range() which
+        is reused for each range of the rule, and includes
         attributes "line_number" and "is_last_line" for identifying where
         in the range processing is occurring and for triggering processing
-        when the end of range pattern matches.
+        when the end of range pattern matches, and "regex", the match of
+        the start (or on the last line, end) pattern.  Patterns that are
+        plain strings, like r'\);', are found with str.find() rather than
+        the regex engine, and their match objects have no groups.
+        "context.range" is left set after the last line of a range, so
+        rules can tell that a range ended from its "is_last_line".
 
         Example:
 
-            #  Extract CREATE TABLE statements and add line numbers
+            #  Extract CREATE TABLE statements and add line numbers, a
+            #  StringSink() collects them without copying the string
+            #  for every line.
             @tc.range(r'CREATE TABLE', r'\);')
             def line(context, line):
                 context.data += ((
                     'line %d:' % context.range.line_number) + line)
                 if context.range.is_last_line:
                     print(context.data)
-                    context.data = ''
+                    context.data = spawk.StringSink()
 
         :param start: Regular expression pattern which identifies the
                 starting line for the decorated function to operate on.
         :param end: Regular expression pattern which identifies the
                 last line of the range.
         '''  # noqa: W605
-        rx_start = re.compile(start).search
-        rx_end = re.compile(end).search
-
-        def inner(f=_print):
-            class RangeWrapper:
-                def __init__(self, rx_start, rx_end, f):
-                    self.rx_start = rx_start
-                    self.rx_end = rx_end
-                    self.f = f
-                    self.in_range = False
-
-                def __call__(self, context, line):
-                    if not self.in_range:
-                        m = self.rx_start(line)
-                        if not m:
-                            return
-                        self.in_range = True
-                        context.range = Context()
-                        context.range.regex = m
-                        context.range.line_number = 0
-                        context.range.is_last_line = False
-
-                    context.range.line_number += 1
-                    m = self.rx_end(line)
-                    if m:
-                        context.range.regex = m
-                        context.range.is_last_line = True
-                    ret = self.f(context, line)
+        with _regex_backend(self.regex_backend):
+            rx_start = _search(_encode(start, self.binary))
+            rx_end = _search(_encode(end, self.binary))
+
+        def inner(f=None):
+            if f is None:
+                f = self._default_action()
+            range_context = Range()
+            in_range = False
+
+            #  The state is kept in closure variables rather than on a
+            #  wrapper object, so the per-line call reads them as cells
+            #  instead of instance attributes.
+            def wrapper(context, line):
+                nonlocal in_range
+                if not in_range:
+                    m = rx_start(line)
                     if not m:
-                        return ret
-                    self.in_range = False
-                    del(context.range)
-                    return ret
+                        return
+                    in_range = True
+                    range_context.reset(m)
 
-            self.main_handlers.append(RangeWrapper(rx_start, rx_end, f))
+                range_context.line_number += 1
+                m = rx_end(line)
+                if m:
+                    range_context.regex = m
+                    range_context.is_last_line = True
+                    in_range = False
+                context.range = range_context
+                return f(context, line)
+
+            self.main_handlers.append(wrapper)
             return f
         return inner
 
@@ -283,16 +655,19 @@ class Spawk:
                 spawk context as it's local context.  If it evaluates
                 to true, the decorated function is run.
         '''
-        def inner(f=_print):
+        predicate = _compile_predicate(code)
+
+        def inner(f=None):
+            if f is None:
+                f = self._default_action()
             def wrapper(context, line):
-                context.line = line
-                eval_ret = eval(code, None, vars(context))
-                del(context.line)
+                eval_ret = predicate(context, line)
                 if eval_ret:
                     context.eval = eval_ret
                     ret = f(context, line)
                     del(context.eval)
                     return ret
+            wrapper._spawk_inline = ('eval', predicate, f)
             self.main_handlers.append(wrapper)
             return f
         return inner
@@ -1,6 +1,16 @@
 #!/usr/bin/env python3
 # vim: ts=4 sw=4 ai et
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
 
 class FileFollower:
     '''Iterator that follows the changes to a file "tail -F"-like.
@@ -14,59 +24,248 @@ class FileFollower:
 
         tc = Spawk(FileFollower('syslog'))
 
+    If the "inotify_simple" module is installed (Linux), rather than
+    sleeping between polls it waits for a change in the file's directory,
+    so new lines are produced as soon as they are written.  The file is
+    still checked every "sleep_time" seconds.
+
     :param filename: Name of the file to follow.
     :param sleep_time: (float) Time to sleep between polls of the file.
+    :param bufsize: (int) Size of the blocks read from the file.
+    :param seek_end: (bool) Start following at the end of the file, as
+            with "tail -n 0 -F", rather than producing the lines already
+            in it.  Files re-opened later are read from the start.
     '''
-    def __init__(self, filename, sleep_time=1):
+    def __init__(self, filename, sleep_time=1, bufsize=65536, seek_end=False):
         self.filename = filename
         self.sleep_time = sleep_time
+        self.bufsize = bufsize
+        self.seek_end = seek_end
 
     def _follow(self):
+        '''INTERNAL: Generator that yields the lines within the file.
+        It sets up waiting for changes to the file and releases it when
+        the generator is closed.
+        '''
+        wait, close = self._watch()
+        try:
+            yield from self._follow_file(wait)
+        finally:
+            close()
+
+    def _follow_file(self, wait):
         '''INTERNAL: Generator that yields the lines within the file.
         It implements the logic of polling for file modifications and
-        re-opening the file when appropriate.
+        re-opening the file when appropriate, calling "wait" between polls.
+        The file is read in binary blocks into a single preallocated
+        buffer, and the complete lines in a block, up to its last newline,
+        are decoded and split at once; only the incomplete last line is
+        kept between reads.
         '''
-        import time
         import os
 
         fp = None
         stats = None
-        data = ''
+        buf = bytearray()
+        block = memoryview(bytearray(self.bufsize))
+        seek_end = self.seek_end
         while True:
             if not fp:
                 try:
-                    fp = open(self.filename, 'r')
+                    fp = open(self.filename, 'rb')
                     stats = os.stat(fp.fileno())
+                    if seek_end:
+                        fp.seek(0, os.SEEK_END)
+                        seek_end = False
                 except FileNotFoundError:
-                    time.sleep(self.sleep_time)
+                    wait()
                     continue
                 except KeyboardInterrupt:
                     break
 
-            next_block = fp.read(1024)
-            if not next_block:
+            length = fp.readinto(block)
+            if not length:
                 try:
                     new_stats = os.stat(self.filename)
                 except FileNotFoundError:
-                    fp = None
-                    continue
+                    new_stats = None
                 if (
-                        new_stats.st_ino != stats.st_ino
+                        new_stats is None
+                        or new_stats.st_ino != stats.st_ino
                         or new_stats.st_dev != stats.st_dev
                         or new_stats.st_size < stats.st_size):
+                    fp.close()
                     fp = None
+                    if buf:
+                        yield buf.decode()
+                        buf.clear()
                 else:
-                    time.sleep(self.sleep_time)
+                    wait()
                 stats = new_stats
                 continue
 
-            data += next_block
-            if '\n' not in next_block:
-                continue
+            buf += block[:length]
+            end = buf.rfind(b'\n') + 1
+            if end:
+                lines = buf[:end].decode().split('\n')
+                lines.pop()
+                for line in lines:
+                    yield line + '\n'
+                del buf[:end]
+
+    def _watch(self):
+        '''INTERNAL: Set up waiting for the file to change.
+        With inotify_simple, this waits for an event in the directory of
+        the file, for at most "sleep_time", otherwise it sleeps.
 
-            for data in data.splitlines(True) + ['']:
-                if data.endswith('\n'):
-                    yield data
+        :rtype: Tuple of functions (wait, close), to wait for a change and
+                to release the watch.
+        '''
+        import os
+        import time
+
+        def sleep():
+            time.sleep(self.sleep_time)
+
+        if inotify_simple is None:
+            return sleep, lambda: None
+        flags = inotify_simple.flags
+        inotify = inotify_simple.INotify()
+        try:
+            inotify.add_watch(
+                os.path.dirname(os.path.abspath(self.filename)),
+                flags.MODIFY | flags.CREATE | flags.DELETE | flags.MOVED_TO
+                | flags.MOVED_FROM | flags.ATTRIB)
+        except OSError:
+            inotify.close()
+            return sleep, lambda: None
+        timeout = self.sleep_time * 1000
+
+        def wait():
+            inotify.read(timeout=timeout)
+        return wait, inotify.close
 
     def __iter__(self):
         return self._follow()
+
+
+class BlockLineReader:
+    r'''Iterator that reads a file in large blocks and splits out the lines.
+    Reading big blocks and splitting them in one call avoids the per-line
+    overhead of iterating over the file object.  Lines are split only on
+    "\n" and keep their line ending, as with iterating over a file.  The
+    file may be opened in text or binary mode.  Buffered binary files are
+    read with read1(), which returns the data that is available rather
+    than waiting for a full block, so it can be used on pipes.
+
+    Example:
+
+        tc = Spawk(BlockLineReader(open('access.log')))
+
+    :param fp: File object to read from.
+    :param bufsize: (int) Size of the blocks read from the file.
+    '''
+    def __init__(self, fp, bufsize=262144):
+        self.fp = fp
+        self.bufsize = bufsize
+
+    def __iter__(self):
+        read = getattr(self.fp, 'read1', self.fp.read)
+        bufsize = self.bufsize
+
+        block = read(bufsize)
+        newline = b'\n' if isinstance(block, bytes) else '\n'
+        tail = block[:0]
+        while block:
+            lines = block.split(newline)
+            lines[0] = tail + lines[0]
+            tail = lines.pop()
+            for line in lines:
+                yield line + newline
+            block = read(bufsize)
+        if tail:
+            yield tail
+
+
+class MmapLineIterator:
+    r'''Iterator that produces the lines of a file by memory mapping it.
+    The file is mapped read-only and scanned for newlines in place, so
+    the data is read straight from the page cache with no buffered I/O
+    layer copying it.  Only the lines themselves are copied out and
+    decoded.  If numpy is installed, the newlines are found with
+    vectorized comparisons.  Lines are split only on "\n" and are not
+    newline-translated, so "\r\n" line endings are preserved.  The file
+    must be a regular file.
+
+    Example:
+
+        tc = Spawk(MmapLineIterator('access.log'))
+
+    :param filename: Name of the file to read.
+    :param encoding: Encoding used to decode the lines, or None to
+            produce the lines as undecoded bytes.
+    '''
+    def __init__(self, filename, encoding='utf-8'):
+        self.filename = filename
+        self.encoding = encoding
+
+    def __iter__(self):
+        import mmap
+        import os
+
+        with open(self.filename, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                return
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if numpy is not None:
+                    yield from self._split_numpy(mm)
+                    return
+                find = mm.find
+                encoding = self.encoding
+                start = 0
+                end = find(b'\n') + 1
+                if encoding is None:
+                    while end:
+                        yield mm[start:end]
+                        start = end
+                        end = find(b'\n', start) + 1
+                    if start < len(mm):
+                        yield mm[start:]
+                    return
+                while end:
+                    yield mm[start:end].decode(encoding)
+                    start = end
+                    end = find(b'\n', start) + 1
+                if start < len(mm):
+                    yield mm[start:].decode(encoding)
+
+    def _split_numpy(self, mm, blocksize=1 << 24):
+        '''INTERNAL: Split the mapped file into lines using numpy.
+        The newlines in each block of the file are found in one vectorized
+        comparison rather than a find() call per line.
+
+        :param mm: mmap of the file.
+        :param blocksize: (int) Number of bytes searched at a time.
+        '''
+        encoding = self.encoding
+        view = numpy.frombuffer(mm, dtype=numpy.uint8)
+        try:
+            start = 0
+            for offset in range(0, len(view), blocksize):
+                block = view[offset:offset + blocksize]
+                ends = (numpy.flatnonzero(block == 10) + (offset + 1)).tolist()
+                del block
+                for end in ends:
+                    if encoding is None:
+                        yield mm[start:end]
+                    else:
+                        yield mm[start:end].decode(encoding)
+                    start = end
+            if start < len(mm):
+                if encoding is None:
+                    yield mm[start:]
+                else:
+                    yield mm[start:].decode(encoding)
+        finally:
+            #  The mmap can't be closed while numpy is using its buffer.
+            del view
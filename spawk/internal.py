@@ -1,29 +1,86 @@
 #!/usr/bin/env python3
 # vim: ts=4 sw=4 ai et
 
-from .objects import String
+from .input import BlockLineReader
+from .objects import String, Bytes
 
+import ast
+import builtins
+import codecs
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import os
+import re
 import sys
 
+try:
+    from re import _parser as _sre_parse
+except ImportError:
+    import sre_parse as _sre_parse
 
-class StringIterator:
-    '''INTERNAL: Wrapper that converts str()s to String()s.
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+try:
+    import regex
+except ImportError:
+    regex = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+_backend = contextvars.ContextVar('spawk_regex_backend', default=None)
+
+_metacharacters = re.compile(r'[.^$*+?{}\[\]|()\\]')
+_backreference = re.compile(r'\\[1-9]|\(\?P=')
+_buffer_unsafe = re.compile(r'\\[AZ]|\(\?')
+
+
+def StringIterator(data, binary=False):
+    '''INTERNAL: Convert str()s to String()s.
     This is used on the inner-most layer of the Spawk pipeline to
     convert the input lines into rich Spawk.String() objects containing
-    the line number.
+    the line number.  Seekable files, and binary files that can return
+    partial blocks, are read in large blocks with a BlockLineReader().
+    The lines are numbered by map() over a counter,
+    so there is no Python-level iterator step per line.
+
+    :param data: Iterable of lines to wrap.
+    :param binary: If true, the input lines are bytes and are wrapped in
+            Bytes() objects instead.
+    :rtype: Iterator of the String() or Bytes() lines.
+    '''
+    if (hasattr(data, 'seekable') and data.seekable()) or (
+            binary and hasattr(data, 'read1')):
+        data = BlockLineReader(data)
+    return map(Bytes if binary else String, data, itertools.count(1))
 
-    :param data: Iterator that this class wraps.
+
+class RawLineIterator:
+    '''INTERNAL: Lightweight alternative to StringIterator.
+    This produces "(line_number, line)" tuples, leaving the lines as the
+    plain str()s read from the input, for consumers that only need the
+    line number transiently and don't want a String() built per line.
+
+    :param data: Iterable that this class wraps.
     '''
     def __init__(self, data):
         self.data = data
-        self.lineno = 0
 
     def __iter__(self):
-        return self
-
-    def __next__(self):
-        self.lineno += 1
-        return String(self.data.__next__(), self.lineno)
+        return enumerate(self.data, 1)
 
 
 def _print(context, line):
@@ -34,5 +91,964 @@ def _print(context, line):
     t.pattern('match')()
 
     This is how Python accesses decorators with no associated function.
+    Bytes lines are written with _write_bytes().
     '''
+    if isinstance(line, bytes):
+        _write_bytes(line)
+        return
     sys.stdout.write(line)
+
+
+def _write_bytes(data):
+    '''INTERNAL: Write bytes to the underlying binary stdout.  A replaced
+    sys.stdout, such as an io.StringIO(), may have no binary buffer, and
+    is written the decoded text instead.
+
+    :param data: bytes to write.
+    '''
+    buffer = getattr(sys.stdout, 'buffer', None)
+    if buffer is None:
+        encoding = getattr(sys.stdout, 'encoding', None) or 'utf-8'
+        sys.stdout.write(data.decode(encoding, 'replace'))
+        return
+    sys.stdout.flush()
+    buffer.write(data)
+
+
+def _takes_match(f):
+    '''INTERNAL: Does the handler take the regex match as an argument?
+    Handlers are normally called as "f(context, line)"; this is true if
+    "f" requires exactly three positional arguments, in which case
+    pattern() calls it as "f(context, line, match)".
+
+    :param f: Handler function to inspect.
+    '''
+    try:
+        parameters = inspect.signature(f).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    required = [
+        p for p in parameters
+        if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+        and p.default is p.empty]
+    return len(required) == 3
+
+
+def _compile(pattern):
+    '''INTERNAL: Compile a regular expression using the selected backend.
+    The backend is chosen by the "regex_backend" of the Spawk() compiling
+    the pattern (see _regex_backend()), or else the SPAWK_REGEX_BACKEND
+    environment variable: "re" (the default) uses the standard library
+    module, "re2" uses the google-re2 module for linear-time DFA matching,
+    "regex" uses the "regex" module, and "auto" uses re2 when it is
+    installed.  Patterns that re2 can not handle, such as backreferences
+    and lookaround, fall back to the "re" module.
+
+    Compiled patterns are cached, so Spawk() instances using the same
+    patterns share them.
+
+    :param pattern: Regular expression pattern to compile.
+    :rtype: A compiled pattern object with a "search()" method.
+    '''
+    return _compile_cached(pattern, _current_backend())
+
+
+def _current_backend():
+    '''INTERNAL: The regex backend to compile patterns with, checked.'''
+    backend = _backend.get() or os.environ.get('SPAWK_REGEX_BACKEND', 're')
+    _check_backend(backend)
+    return backend
+
+
+def _check_backend(backend):
+    '''INTERNAL: Raise an exception if the regex backend is not usable.'''
+    if backend not in ('re', 're2', 'regex', 'auto'):
+        raise ValueError('Unknown regex backend: {!r}'.format(backend))
+    if backend == 're2' and re2 is None:
+        raise ImportError('Regex backend is "re2" but re2 is not installed')
+    if backend == 'regex' and regex is None:
+        raise ImportError(
+            'Regex backend is "regex" but regex is not installed')
+
+
+@contextlib.contextmanager
+def _regex_backend(backend):
+    '''INTERNAL: Compile the patterns in the block with "backend".
+    Spawk() compiles its patterns in this, so its "regex_backend" is used
+    by the helpers that compile them.  None leaves the choice to the
+    SPAWK_REGEX_BACKEND environment variable.
+
+    :param backend: "re", "re2", "regex", "auto" or None.
+    '''
+    token = _backend.set(backend)
+    try:
+        yield
+    finally:
+        _backend.reset(token)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_cached(pattern, backend):
+    '''INTERNAL: Compile a regular expression with a checked backend.
+    See _compile().
+    '''
+    if backend == 'regex':
+        try:
+            return regex.compile(pattern)
+        except regex.error:
+            pass
+    elif backend != 're' and re2 is not None:
+        try:
+            return re2.compile(pattern)
+        except re2.error:
+            pass
+    return re.compile(pattern)
+
+
+class _ContextNameRewriter(ast.NodeTransformer):
+    '''INTERNAL: Rewrite the free names in an eval() expression.
+    "line" and names bound within the expression, by the comprehensions
+    or lambdas they are used in, are left alone.  Other names become
+    "context.name", except that names of builtins and of the globals
+    become "getattr(context, 'name', name)" so that a context attribute
+    still shadows them as it does when eval()ed with the context as the
+    locals.
+
+    :param names: Names of the builtins and globals.
+    :ivar free: Set of the names rewritten into "context.name".
+    '''
+    def __init__(self, names):
+        self.names = names
+        self.scopes = []
+        self.free = set()
+
+    def visit_Name(self, node):
+        if (not isinstance(node.ctx, ast.Load) or node.id == 'line'
+                or any(node.id in x for x in self.scopes)):
+            return node
+        context = ast.Name(id='context', ctx=ast.Load())
+        if node.id in self.names:
+            new = ast.Call(
+                func=ast.Name(id='getattr', ctx=ast.Load()),
+                args=[context, ast.Constant(node.id), node], keywords=[])
+        else:
+            self.free.add(node.id)
+            new = ast.Attribute(value=context, attr=node.id, ctx=ast.Load())
+        return ast.copy_location(new, node)
+
+    def visit_Lambda(self, node):
+        args = node.args
+        args.defaults = [self.visit(x) for x in args.defaults]
+        args.kw_defaults = [
+            x if x is None else self.visit(x) for x in args.kw_defaults]
+        bound = {
+            x.arg for x in args.posonlyargs + args.args + args.kwonlyargs}
+        bound.update(x.arg for x in (args.vararg, args.kwarg) if x)
+        self.scopes.append(bound)
+        node.body = self.visit(node.body)
+        self.scopes.pop()
+        return node
+
+    def visit_comprehension_scope(self, node):
+        #  The first iterable is evaluated in the enclosing scope.
+        generators = node.generators
+        generators[0].iter = self.visit(generators[0].iter)
+        self.scopes.append({
+            x.id for generator in generators
+            for x in ast.walk(generator.target) if isinstance(x, ast.Name)})
+        for i, generator in enumerate(generators):
+            if i:
+                generator.iter = self.visit(generator.iter)
+            generator.ifs = [self.visit(x) for x in generator.ifs]
+        for field in ('elt', 'key', 'value'):
+            if hasattr(node, field):
+                setattr(node, field, self.visit(getattr(node, field)))
+        self.scopes.pop()
+        return node
+
+    visit_ListComp = visit_SetComp = visit_comprehension_scope
+    visit_DictComp = visit_GeneratorExp = visit_comprehension_scope
+
+
+def _eval_globals():
+    '''INTERNAL: The globals eval() expressions are run with.  These are
+    the globals of the engine module, where the expressions used to be
+    eval()ed, so names like "re" resolve as they always have.
+    '''
+    from . import engine
+    return vars(engine)
+
+
+class _ContextLocals:
+    '''INTERNAL: Mapping of a context's attributes, for use as the locals
+    of eval().  Some context attributes are slots, so its __dict__ does
+    not hold them all.  "line" is the line being evaluated, and isn't
+    stored on the context.
+
+    :param context: The Context().
+    :param line: The line.
+    '''
+    __slots__ = ('context', 'line')
+
+    def __init__(self, context, line):
+        self.context = context
+        self.line = line
+
+    def __getitem__(self, name):
+        if name == 'line':
+            return self.line
+        try:
+            return getattr(self.context, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def __setitem__(self, name, value):
+        if name == 'line':
+            self.line = value
+        else:
+            setattr(self.context, name, value)
+
+    def __delitem__(self, name):
+        try:
+            delattr(self.context, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_predicate(code):
+    '''INTERNAL: Compile an eval() expression into a predicate function.
+    The expression is compiled once into "lambda context, line: <code>"
+    with the names it uses rewritten into attribute lookups on the
+    context, so evaluating it per line needs no namespace dictionary.
+    Names of builtins and of the engine module's globals, such as "re",
+    are used if the context doesn't have them.  If the expression uses
+    other names, it is run in a try, so a name missing from the context
+    raises NameError.  On Pythons before 3.10, whose AttributeError
+    doesn't say which object it is for, it is left an AttributeError.
+    Expressions containing assignment expressions, which store into the
+    context, fall back to eval() of a pre-compiled code object with a
+    _ContextLocals() mapping of the context's attributes as the locals.
+    The compiled predicates are cached by the code string.
+
+    :param code: String of Python code to evaluate.
+    :rtype: Function taking (context, line) and returning the result.
+    '''
+    tree = ast.parse(code, mode='eval')
+    namespace = _eval_globals()
+    if any(isinstance(x, ast.NamedExpr) for x in ast.walk(tree)):
+        code_obj = compile(tree, '<spawk.eval>', 'eval')
+
+        def predicate(context, line):
+            return eval(code_obj, namespace, _ContextLocals(context, line))
+        return predicate
+
+    rewriter = _ContextNameRewriter(set(vars(builtins)) | set(namespace))
+    body = rewriter.visit(tree.body)
+    if not rewriter.free:
+        args = ast.arguments(
+            posonlyargs=[], args=[ast.arg('context'), ast.arg('line')],
+            kwonlyargs=[], kw_defaults=[], defaults=[])
+        expression = ast.Expression(ast.Lambda(args=args, body=body))
+        ast.fix_missing_locations(expression)
+        return eval(compile(expression, '<spawk.eval>', 'eval'), namespace)
+
+    #  A name missing from the context is a NameError, as it was when the
+    #  context was the locals, so the expression is run in a try.
+    module = ast.parse(_predicate_template)
+    module.body[0].body[0].body[0].body[0].value = body
+    ast.fix_missing_locations(module)
+    scope = {}
+    exec(compile(module, '<spawk.eval>', 'exec'), namespace, scope)
+    return scope['_make'](frozenset(rewriter.free), _name_error)
+
+
+_predicate_template = '''
+def _make(_free, _name_error):
+    def _predicate(context, line):
+        try:
+            return None
+        except AttributeError as e:
+            _name_error(e, context, _free)
+            raise
+    return _predicate
+'''
+
+
+def _name_error(error, context, free):
+    '''INTERNAL: Raise a NameError if the AttributeError from an eval()
+    expression is for one of its names missing from the context.
+
+    :param error: The AttributeError.
+    :param context: The Context().
+    :param free: Set of the expression's names looked up on the context.
+    '''
+    if getattr(error, 'obj', None) is context and error.name in free:
+        raise NameError(
+            'name {!r} is not defined'.format(error.name)) from None
+
+
+def _is_literal(pattern):
+    '''INTERNAL: Is the regular expression a plain string with no special
+    characters, so it can be matched with "pattern in line"?
+    '''
+    return not _metacharacters.search(_as_text(pattern))
+
+
+def _as_text(pattern):
+    '''INTERNAL: Bytes patterns as str, for inspecting their syntax.'''
+    if isinstance(pattern, bytes):
+        return pattern.decode('latin-1')
+    return pattern
+
+
+def _encode(pattern, binary):
+    '''INTERNAL: Convert a str pattern to bytes for matching Bytes lines.
+
+    :param pattern: Regular expression pattern.
+    :param binary: If false, the pattern is returned unchanged.
+    '''
+    if binary and isinstance(pattern, str):
+        return pattern.encode()
+    return pattern
+
+
+@functools.lru_cache(maxsize=1024)
+def _required_literal(pattern):
+    '''INTERNAL: Find a string that any match of the pattern must contain.
+    The parsed pattern is walked for runs of literal characters that are
+    not optional, such as "GET /" in r"^GET /\S+", and the longest is
+    returned.  Lines that don't contain it can be rejected with a fast
+    substring test before running the regex.
+
+    :param pattern: Regular expression pattern.
+    :rtype: str or bytes (as the pattern) of at least two characters, or
+            None if there is no such literal.
+    '''
+    try:
+        parsed = _sre_parse.parse(pattern)
+    except re.error:
+        return None
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    if state.flags & re.IGNORECASE:
+        return None
+
+    runs = []
+
+    def walk(items):
+        run = []
+        for op, av in items:
+            if op is _sre_parse.LITERAL:
+                run.append(av)
+                continue
+            if run:
+                runs.append(run)
+                run = []
+            if op is _sre_parse.SUBPATTERN:
+                if not av[1] & re.IGNORECASE:
+                    walk(av[-1])
+            elif op in (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT):
+                if av[0] >= 1:
+                    walk(av[2])
+        if run:
+            runs.append(run)
+    walk(parsed)
+
+    if not runs:
+        return None
+    longest = max(runs, key=len)
+    if len(longest) < 2:
+        return None
+    if isinstance(pattern, bytes):
+        return bytes(longest)
+    return ''.join(map(chr, longest))
+
+
+@functools.lru_cache(maxsize=1024)
+def _literal_pattern(pattern):
+    r'''INTERNAL: The string a pattern matches, if it is nothing but literal
+    characters, including escaped ones such as r"\);".
+
+    :param pattern: Regular expression pattern.
+    :rtype: str or bytes (as the pattern), or None if the pattern is not a
+            plain string.
+    '''
+    try:
+        parsed = _sre_parse.parse(pattern)
+    except re.error:
+        return None
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    if state.flags & re.IGNORECASE or not len(parsed):
+        return None
+    if any(op is not _sre_parse.LITERAL for op, av in parsed):
+        return None
+    codes = [av for op, av in parsed]
+    if isinstance(pattern, bytes):
+        return bytes(codes)
+    return ''.join(map(chr, codes))
+
+
+class _LiteralMatch:
+    '''INTERNAL: Match object for a pattern that is a plain string.
+    This provides the parts of the "re" match object interface that make
+    sense for a match with no groups, without running the regex.
+    '''
+    __slots__ = ('string', 'pattern', 'pos', 'endpos', '_start', '_end')
+
+    lastindex = None
+    lastgroup = None
+
+    def __init__(self, string, pattern, start, end):
+        self.string = string
+        self.pattern = pattern
+        self.pos = 0
+        self.endpos = len(string)
+        self._start = start
+        self._end = end
+
+    @property
+    def re(self):
+        return _compile(self.pattern)
+
+    def _check(self, group):
+        if group != 0:
+            raise IndexError('no such group')
+
+    def group(self, *groups):
+        for group in groups:
+            self._check(group)
+        text = self.string[self._start:self._end]
+        if len(groups) > 1:
+            return (text,) * len(groups)
+        return text
+
+    def __getitem__(self, group):
+        return self.group(group)
+
+    def groups(self, default=None):
+        return ()
+
+    def groupdict(self, default=None):
+        return {}
+
+    def start(self, group=0):
+        self._check(group)
+        return self._start
+
+    def end(self, group=0):
+        self._check(group)
+        return self._end
+
+    def span(self, group=0):
+        self._check(group)
+        return (self._start, self._end)
+
+    def expand(self, template):
+        return self.re.search(self.string, self._start).expand(template)
+
+    def __repr__(self):
+        return '<spawk literal match; span=%r, match=%r>' % (
+            self.span(), self.group())
+
+
+def _union(patterns):
+    '''INTERNAL: Combine patterns into a single alternation regex.
+
+    :param patterns: List of regular expression patterns.
+    :rtype: The search function of the combined regex, or None if the
+            patterns can't be combined.
+    '''
+    combined = _combine(patterns)
+    if combined is None:
+        return None
+    try:
+        return _compile(combined).search
+    except re.error:
+        return None
+
+
+def _no_match(line):
+    '''INTERNAL: Search function for an empty list of patterns, which
+    match no lines.
+    '''
+    return None
+
+
+def _combine(patterns):
+    '''INTERNAL: Join patterns into the source of an alternation regex.
+
+    :param patterns: List of regular expression patterns.
+    :rtype: The combined pattern, or None if the patterns use
+            backreferences, whose group numbers would shift.
+    '''
+    if any(_backreference.search(_as_text(x)) for x in patterns):
+        return None
+    if isinstance(patterns[0], bytes):
+        return b'|'.join(b'(?:%s)' % x for x in patterns)
+    return '|'.join('(?:%s)' % x for x in patterns)
+
+
+def _grep_buffer(buf, patterns, cls):
+    '''INTERNAL: grep() the lines of a whole in-memory buffer.
+    Instead of searching each line, the union of the patterns is searched
+    for across the buffer with "^" and "$" matching at line boundaries.
+    The line containing the start of each match is checked with the
+    per-line matcher, since a pattern like "\\s" can match across a
+    newline, and the search resumes at the start of the next line.
+
+    If the "hyperscan" module is installed, bytes buffers are instead
+    scanned for all of the patterns in one pass of its automaton.
+
+    :param buf: str, bytes or mmap holding the lines.
+    :param patterns: List of regular expression patterns.
+    :param cls: String or Bytes, the class the matching lines are made.
+    :rtype: Generator of the matching lines, or None if the patterns can't
+            be searched for across the buffer.
+    '''
+    if not patterns:
+        return iter(())
+    if any(_buffer_unsafe.search(_as_text(x)) for x in patterns):
+        return None
+    if hyperscan is not None and isinstance(buf, bytes):
+        database = _hyperscan_database(tuple(patterns))
+        if database is not None:
+            return _grep_buffer_hyperscan(buf, database, patterns, cls)
+    combined = _combine(patterns)
+    if combined is None:
+        return None
+    if isinstance(buf, str):
+        newline = '\n'
+        combined = '(?m)' + combined
+    else:
+        newline = b'\n'
+        combined = b'(?m)' + combined
+    try:
+        search = _compile(combined).search
+    except re.error:
+        return None
+    predicate = _grep_predicate(patterns)
+    if hasattr(buf, 'count'):
+        count = buf.count
+    else:
+        #  mmap has no count(), the skipped lines are counted in a copy.
+        def count(sub, start, end):
+            return buf[start:end].count(sub)
+
+    def lines():
+        lineno = 1
+        counted = 0
+        pos = 0
+        while True:
+            m = search(buf, pos)
+            if m is None:
+                return
+            start = buf.rfind(newline, 0, m.start()) + 1
+            if start >= len(buf):
+                return
+            end = buf.find(newline, m.start()) + 1 or len(buf)
+            line = buf[start:end]
+            if predicate(line):
+                lineno += count(newline, counted, start)
+                counted = start
+                yield cls(line, lineno)
+            if end >= len(buf):
+                return
+            pos = end
+    return lines()
+
+
+def _grep_mmap(filename, patterns, encoding):
+    '''INTERNAL: grep() the lines of a file by memory mapping it.
+    The mapped file is searched with _grep_buffer(), so only the matching
+    lines are copied out of it.  Lines decoded as UTF-8 can be searched
+    in the undecoded file only for plain string patterns, which match the
+    same bytes encoded; other text patterns return None.
+
+    :param filename: Name of the file to search.
+    :param patterns: List of regular expression patterns.
+    :param encoding: Encoding of the lines, or None for Bytes lines.
+    :rtype: Generator of the matching lines, or None if the file can't be
+            searched as a whole.
+    '''
+    import mmap
+
+    if not patterns:
+        return iter(())
+    if encoding is None:
+        cls = Bytes
+    else:
+        if (codecs.lookup(encoding).name != 'utf-8'
+                or not all(_is_literal(x) for x in patterns)):
+            return None
+        patterns = [x.encode() for x in patterns]
+
+        def cls(line, line_number):
+            return String(line.decode(encoding), line_number)
+
+    fp = open(filename, 'rb')
+    if os.fstat(fp.fileno()).st_size == 0:
+        fp.close()
+        return iter(())
+    mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    lines = _grep_buffer(mm, patterns, cls)
+    if lines is None:
+        mm.close()
+        fp.close()
+        return None
+
+    def mapped_lines():
+        try:
+            yield from lines
+        finally:
+            mm.close()
+            fp.close()
+    return mapped_lines()
+
+
+@functools.lru_cache(maxsize=64)
+def _hyperscan_database(patterns):
+    '''INTERNAL: Compile bytes patterns into a hyperscan database.
+    Databases are cached by the patterns.  Patterns that can match the
+    empty string are rejected by hyperscan, as they would report a match
+    at every offset, and are left to the re search.
+
+    :param patterns: Tuple of bytes regular expression patterns.
+    :rtype: The database, or None if hyperscan can't compile the patterns.
+    '''
+    flags = hyperscan.HS_FLAG_MULTILINE | hyperscan.HS_FLAG_SOM_LEFTMOST
+    database = hyperscan.Database()
+    try:
+        database.compile(
+            expressions=list(patterns), ids=list(range(len(patterns))),
+            elements=len(patterns), flags=[flags] * len(patterns))
+    except hyperscan.error:
+        return None
+    return database
+
+
+def _grep_buffer_hyperscan(buf, database, patterns, cls):
+    '''INTERNAL: The hyperscan version of _grep_buffer().
+    The buffer is scanned once, noting the start of the line that each
+    match starts in, and then those lines are checked with the per-line
+    matcher.
+    '''
+    starts = set()
+    rfind = buf.rfind
+
+    def on_match(id, start, end, flags, context):
+        starts.add(rfind(b'\n', 0, start) + 1)
+
+    database.scan(buf, match_event_handler=on_match)
+    predicate = _grep_predicate(patterns)
+
+    lineno = 1
+    counted = 0
+    for start in sorted(starts):
+        if start >= len(buf):
+            break
+        end = buf.find(b'\n', start) + 1 or len(buf)
+        line = buf[start:end]
+        if predicate(line):
+            lineno += buf.count(b'\n', counted, start)
+            counted = start
+            yield cls(line, lineno)
+
+
+def _search(pattern):
+    '''INTERNAL: Build the search function of a pattern, which only runs
+    the regex on lines containing the pattern's required literal, if it
+    has one.  A pattern that is a plain string is found with str.find()
+    without using the regex, and the match is a _LiteralMatch().
+
+    :param pattern: Regular expression pattern.
+    :rtype: Function taking a line and returning the match, or a false
+            value if it doesn't match.
+    '''
+    search = _compile(pattern).search
+    literal = _literal_pattern(pattern)
+    if literal is not None:
+        find = type(literal).find
+        length = len(literal)
+
+        def search(line):
+            start = find(line, literal)
+            if start >= 0:
+                return _LiteralMatch(line, pattern, start, start + length)
+        return search
+
+    literal = _required_literal(pattern)
+    if literal is None:
+        return search
+    return lambda line: literal in line and search(line)
+
+
+def _alternation(patterns):
+    '''INTERNAL: Build a search function that matches any of the patterns.
+    The patterns are normally combined into a single alternation regex so
+    a line is scanned once.  Patterns that can't be combined, because
+    they use backreferences (whose group numbers would shift), inline
+    flags or clashing group names, are instead searched one at a time.
+    A single pattern is searched with _search(), and no patterns match
+    nothing.
+
+    :param patterns: List of regular expression patterns.
+    :rtype: Function taking a line and returning a true value if any of
+            the patterns match.
+    '''
+    if not patterns:
+        return _no_match
+    if len(patterns) == 1:
+        return _search(patterns[0])
+    union = _union(patterns)
+    if union is not None:
+        return union
+
+    searches = tuple(_compile(x).search for x in patterns)
+
+    def search(line):
+        for rx in searches:
+            if rx(line):
+                return True
+        return False
+    return search
+
+
+def _grep_predicate(patterns):
+    '''INTERNAL: Build a function that tests if a line matches any pattern.
+    Literal patterns are tested with "in" (one), or an Aho-Corasick
+    automaton if the "ahocorasick" module is installed (several, str
+    only).  The rest are combined into a single alternation regex.  The
+    functions are cached by the patterns, so repeated grep()s of the same
+    patterns share them.
+
+    :param patterns: List of regular expression patterns.
+    :rtype: Function taking a line and returning a true value if any of
+            the patterns match.
+    '''
+    return _grep_predicate_cached(tuple(patterns), _current_backend())
+
+
+@functools.lru_cache(maxsize=256)
+def _grep_predicate_cached(patterns, backend):
+    '''INTERNAL: Build a grep predicate with a checked backend.
+    See _grep_predicate().
+    '''
+    if not patterns:
+        return _no_match
+    literals = [x for x in patterns if _is_literal(x)]
+    regexes = [x for x in patterns if not _is_literal(x)]
+    if len(literals) > 1 and (
+            ahocorasick is None or isinstance(literals[0], bytes)):
+        regexes += literals
+        literals = []
+
+    tests = []
+    if len(literals) == 1:
+        literal = literals[0]
+        tests.append(lambda line: literal in line)
+    elif literals:
+        automaton = ahocorasick.Automaton()
+        for literal in literals:
+            automaton.add_word(literal, literal)
+        automaton.make_automaton()
+        tests.append(lambda line: next(automaton.iter(line), None))
+    if regexes:
+        tests.append(_alternation(regexes))
+
+    if len(tests) == 1:
+        return tests[0]
+    first, second = tests
+    return lambda line: first(line) or second(line)
+
+
+def _compile_driver(handlers, stages=()):
+    '''INTERNAL: Generate the per-line loop for a list of main handlers.
+    Rather than calling each handler through a loop over the list, the
+    source of a function that runs the handlers in order is generated and
+    compiled.  Handlers made by pattern() and eval() carry a "_spawk_inline"
+    attribute describing them, and their tests are written into the loop
+    so a line that doesn't match costs no call to a wrapper.  The
+    pattern() handlers are only tested if the union of all their patterns
+    matches, and a pattern with a required literal is only searched for
+    in lines containing the literal.  Other handlers are called as
+    "handler(context, line)".
+
+    The grep() and split() stages of the pipeline can also be written into
+    the loop, so the lines don't pass through a generator per stage.
+
+    :param handlers: List of main handler functions.
+    :param stages: Sequence of pipeline stages to run on each line before
+            the handlers, as recorded by the engine: "('grep', patterns)"
+            or "('split', sep, maxsplit)".
+    :rtype: Function taking (context, lines) that runs the handlers over
+            each of the lines.  The compiled code is cached by the shape
+            of the pipeline.
+    '''
+    from .engine import Continue
+
+    namespace = {'_Continue': Continue}
+    #  Input records are never Continue, only handlers return it.
+    source = [
+        None,
+        '    for line in lines:']
+    inlines = [getattr(handler, '_spawk_inline', None) for handler in handlers]
+
+    split = (None, -1)
+    for i, stage in enumerate(stages):
+        if stage[0] == 'split':
+            #  Lines are split lazily, so a split() only has to note the
+            #  separator on lines, and not even that for the default.
+            if stage[1:] != split:
+                split = stage[1:]
+                namespace['_s%d' % i] = split
+                source.append('        line._split = _s%d' % i)
+        elif len(stage[1]) == 1 and _is_literal(stage[1][0]):
+            namespace['_g%d' % i] = stage[1][0]
+            source.append('        if _g%d not in line:' % i)
+            source.append('            continue')
+        else:
+            namespace['_g%d' % i] = _grep_predicate(stage[1])
+            source.append('        if not _g%d(line):' % i)
+            source.append('            continue')
+
+    #  The pattern() handlers are guarded by a single search of the union
+    #  of their patterns, so a line matching none of them is rejected with
+    #  one scan.  The search is redone if a handler replaces the line.
+    patterns = [x[4] for x in inlines if x is not None and x[0] == 'pattern']
+    union = _union(patterns) if len(patterns) > 1 else None
+    if union is not None:
+        namespace['_u'] = union
+        source.append('        hit = _u(line)')
+
+    for i, handler in enumerate(handlers):
+        last = i == len(handlers) - 1
+        inline = inlines[i]
+        is_pattern = inline is not None and inline[0] == 'pattern'
+        guard_indent = ''
+        if is_pattern and union is not None:
+            source.append('        if hit:')
+            guard_indent = '    '
+        indent = '        ' + guard_indent
+        if inline is None:
+            namespace['_h%d' % i] = handler
+            source.append(indent + 'ret = _h%d(context, line)' % i)
+        elif is_pattern:
+            kind, search, f, takes_match, pattern = inline
+            namespace['_rx%d' % i] = search
+            namespace['_h%d' % i] = f
+            #  The search from _search() may already be a literal find(),
+            #  or test the required literal itself, which is done inline
+            #  here instead.
+            literal = _required_literal(pattern)
+            if literal is None or _literal_pattern(pattern) is not None:
+                source.append(indent + 'm = _rx%d(line)' % i)
+            else:
+                namespace['_rx%d' % i] = _compile(pattern).search
+                namespace['_lit%d' % i] = literal
+                source.append(
+                    indent + 'm = _lit%d in line and _rx%d(line)' % (i, i))
+            source.append(indent + 'if m:')
+            indent += '    '
+            if takes_match:
+                source.append(indent + 'ret = _h%d(context, line, m)' % i)
+            else:
+                source.append(indent + 'context.regex = m')
+                source.append(indent + 'ret = _h%d(context, line)' % i)
+        else:
+            kind, predicate, f = inline
+            namespace['_p%d' % i] = predicate
+            namespace['_h%d' % i] = f
+            source.append(indent + 'e = _p%d(context, line)' % i)
+            source.append(indent + 'if e:')
+            indent += '    '
+            source.append(indent + 'context.eval = e')
+            source.append(indent + 'ret = _h%d(context, line)' % i)
+            source.append(indent + 'del context.eval')
+        if last:
+            continue
+        source.append(indent + 'if ret is _Continue:')
+        source.append(indent + '    continue')
+        source.append(indent + 'if ret is not None:')
+        source.append(indent + '    line = ret')
+        if union is not None:
+            source.append(indent + '    hit = _u(line)')
+    if not handlers:
+        source.append('        pass')
+    #  Bind everything as default arguments so the loop uses fast locals.
+    source[0] = 'def _drive(context, lines, %s):' % ', '.join(
+        '%s=%s' % (name, name) for name in namespace)
+
+    exec(_compile_driver_source('\n'.join(source)), namespace)
+    return namespace['_drive']
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_driver_source(source):
+    '''INTERNAL: Compile the source of a driver function.
+    The source depends only on the shape of the pipeline, the kinds of
+    handlers and their order, with the handlers themselves bound when the
+    code is run.  So the compiled code is cached by the source and
+    shared by pipelines of the same shape.
+    '''
+    return compile(source, '<spawk.driver>', 'exec')
+
+
+_parallel_predicates = {}
+
+
+def _parallel_grep(greps, lines, backend=None):
+    '''INTERNAL: Filter a batch of lines in a run_parallel() worker process.
+    The grep predicates are built on the first batch a worker sees and
+    kept for the rest of the run.
+
+    :param greps: Tuple of the grep() pattern tuples, a line must match
+            each of them.
+    :param lines: List of "(line_number, line)" tuples.
+    :param backend: Regex backend of the Spawk(), see _regex_backend().
+    :rtype: List of the "(line_number, line)" tuples that matched.
+    '''
+    predicates = _parallel_predicates.get((greps, backend))
+    if predicates is None:
+        with _regex_backend(backend):
+            predicates = [_grep_predicate(x) for x in greps]
+        _parallel_predicates[greps, backend] = predicates
+    for predicate in predicates:
+        lines = [x for x in lines if predicate(x[1])]
+    return lines
+
+
+def _parallel_grep_mapped(
+        greps, filename, start, end, encoding, backend=None):
+    '''INTERNAL: Filter a segment of a file in a run_parallel() worker.
+    The segment is read from the memory mapped file, so the lines that
+    don't match are never sent between processes.
+
+    :param greps: Tuple of the grep() pattern tuples, a line must match
+            each of them.
+    :param filename: Name of the file.
+    :param start: Offset of the start of the segment, at the start of a
+            line.
+    :param end: Offset of the end of the segment, just after a newline or
+            the end of the file.
+    :param encoding: Encoding used to decode the lines, or None for bytes.
+    :param backend: Regex backend of the Spawk(), see _regex_backend().
+    :rtype: Tuple of the list of "(line_number, line)" tuples that matched,
+            numbered from 1 at the start of the segment, and the number of
+            lines in the segment.
+    '''
+    import mmap
+
+    with open(filename, 'rb') as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = mm[start:end]
+    newline = b'\n'
+    if encoding is not None:
+        data = data.decode(encoding)
+        newline = '\n'
+    lines = data.split(newline)
+    tail = lines.pop()
+    lines = [(i, line + newline) for i, line in enumerate(lines, 1)]
+    if tail:
+        lines.append((len(lines) + 1, tail))
+    count = len(lines)
+    return _parallel_grep(greps, lines, backend), count
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# vim: ts=4 sw=4 ai et
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def jit(f):
+    '''Decorator that compiles a function to machine code with Numba.
+    This is meant for the numeric or string crunching helpers that
+    handlers call on every line, not for the handlers themselves: Numba
+    can only compile functions whose arguments and return values are
+    simple types such as ints, floats, strings and arrays, not the
+    Spawk Context or line objects.  If Numba is not installed the
+    function is returned unchanged.
+
+    Example:
+
+        @jit
+        def count_vowels(s):
+            n = 0
+            for c in s:
+                if c in 'aeiou':
+                    n += 1
+            return n
+
+        @tc.every()
+        def vowels(context, line):
+            context.vowels += count_vowels(str(line))
+    '''
+    if numba is None:
+        return f
+    return numba.njit(cache=True, nogil=True)(f)
+
+
+def _count_words(buf):
+    n = 0
+    in_word = False
+    for c in buf:
+        space = c == 32 or 9 <= c <= 13
+        if not space and not in_word:
+            n += 1
+        in_word = not space
+    return n
+
+
+_count_words = jit(_count_words)
+
+
+def count_words(data):
+    '''Count the whitespace separated words in a string, as
+    "len(data.split())".  If Numba is installed and "data" is bytes, such
+    as a batch of lines or a whole file read in binary mode, the words
+    are counted by a compiled loop over the bytes without building a list
+    of them.
+
+    Example:
+
+        with open('access.log', 'rb') as fp:
+            words = count_words(fp.read())
+
+    :param data: str or bytes to count the words in.
+    :rtype: Number of words.
+    '''
+    if numba is None or not isinstance(data, (bytes, bytearray)):
+        return len(data.split())
+    return _count_words(data)
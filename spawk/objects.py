@@ -1,21 +1,130 @@
 #!/usr/bin/env python3
 # vim: ts=4 sw=4 ai et
 
-class String(str):
+class _Line:
+    '''INTERNAL: Field access shared by String() and Bytes().
+    "fields" is computed the first time it is used, with the separator and
+    maximum number of splits set by a "split()" in the pipeline (stored
+    in "_split"), or the default of splitting on whitespace.
+    '''
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        if name == 'fields':
+            self.fields = self.split(*self._split)
+            return self.fields
+        if name == '_split':
+            return (None, -1)
+        raise AttributeError(
+            '{!r} object has no attribute {!r}'.format(
+                type(self).__name__, name))
+
+    def field(self, i):
+        '''Return field "i" of the line, as "line.fields[i]".  If the
+        fields haven't been split yet, the line is only split as far as
+        the requested field.
+
+        :param i: (int) Index of the field.
+        '''
+        try:
+            return object.__getattribute__(self, 'fields')[i]
+        except AttributeError:
+            pass
+        sep, maxsplit = self._split
+        if i < 0 or 0 <= maxsplit <= i:
+            return self.fields[i]
+        return self.split(sep, i + 1)[i]
+
+
+class String(_Line, str):
     '''A rich string object for Spawk().
     This object is a string but with extra attributes specifying the
     line number within the input and the fields within the line from
     "string".split().
+
+    The attributes are stored in __slots__ rather than a per-line instance
+    dictionary, so arbitrary attributes can not be set on lines.
+
+    "fields" is computed the first time it is used, so lines that never
+    look at their fields don't pay for splitting.  "field(i)" gets a
+    single field, splitting only as far as it.
     '''
+    __slots__ = ('line_number', 'fields', '_split')
+
     def __new__(cls, s, line_number):
-        return super().__new__(cls, s)
+        self = super().__new__(cls, s)
+        self.line_number = line_number
+        return self
+
 
-    def __init__(self, s, line_number):
+class Bytes(_Line, bytes):
+    '''A rich bytes object for Spawk(binary=True).
+    This is the bytes equivalent of String(), used when the input is
+    processed without being decoded, with the same "line_number" and
+    lazily computed "fields" attributes.
+
+    bytes subclasses can not have non-empty __slots__, so the attributes
+    are stored in an instance dictionary.
+    '''
+    def __new__(cls, s, line_number):
+        self = super().__new__(cls, s)
         self.line_number = line_number
+        return self
 
 
 class Context:
     '''A simple object used as a context which attributes can be set on
     for use between the different functions in a Spawk() processing
-    pipeline.'''
-    pass
+    pipeline.  The attributes set by the engine for every match, and
+    "data", are slots; any other attributes can be set as well.'''
+    __slots__ = ('data', 'range', 'regex', 'eval', '__dict__')
+
+
+class StringSink(list):
+    '''A list of str pieces, for building up a string with "+=", such as
+    the lines collected by a rule.  Repeatedly doing "context.data += line"
+    on a str copies the whole string each time, "+=" on this appends the
+    piece instead.  It is otherwise a plain list of the pieces, so len()
+    and indexing are of the pieces; use str() to get the joined string.
+
+    Example:
+
+        t.context.lines = spawk.StringSink()
+
+        @t.pattern(r'ERROR')
+        def errors(context, line):
+            context.lines += line
+        t.run()
+        print(str(t.context.lines))
+    '''
+    def __iadd__(self, s):
+        self.append(s)
+        return self
+
+    def __str__(self):
+        return ''.join(self)
+
+
+class Range:
+    '''The "context.range" of a Spawk.range() rule.
+    One of these is kept per range() rule and reset at the start of each
+    range, rather than a new object being made for every range.
+
+    :ivar line_number: Line number within the range, starting at 1.
+    :ivar is_last_line: True on the line that matched the end pattern.
+    :ivar regex: Match of the start pattern, or of the end pattern on the
+            last line.
+    '''
+    __slots__ = ('line_number', 'is_last_line', 'regex')
+
+    def __init__(self):
+        self.reset(None)
+
+    def reset(self, regex):
+        '''Start a new range.
+
+        :param regex: Match of the start pattern.
+        '''
+        self.regex = regex
+        self.line_number = 0
+        self.is_last_line = False
@@ -1,5 +1,8 @@
 from . import AbstractRecords
 import apache_log_parser
+import collections
+import collections.abc
+import functools
 
 
 FORMAT_VHOST_COMBINED = (
@@ -9,11 +12,150 @@ FORMAT_COMBINED = (
         r'''%h %l %u %t "%r" %>s %O "%{Referer}i" "%{User-Agent}i"''')
 FORMAT_COMMON = r'''%h %l %u %t \"%r\" %>s %O'''
 
+#  Fields that are expensive to parse, produce only immutable values, and
+#  tend to repeat from line to line, so their parse results are cached.
+_CACHED_FIELDS = ('time_received', 'request_header_user_agent')
+
+#  All the keys that the apache_log_parser field parsers which expand a
+#  field can produce.  Some keys are left out for some lines, such as the
+#  "request_url_*" keys for a "-" request line.  The other field parsers
+#  produce just the field's own name.
+_PARSER_KEYS = {
+    apache_log_parser.extra_request_from_first_line: (
+        'request_first_line', 'request_method', 'request_url',
+        'request_http_ver', 'request_url_scheme', 'request_url_netloc',
+        'request_url_path', 'request_url_query', 'request_url_fragment',
+        'request_url_username', 'request_url_password',
+        'request_url_hostname', 'request_url_port', 'request_url_query_dict',
+        'request_url_query_list', 'request_url_query_simple_dict'),
+    apache_log_parser.parse_user_agent: (
+        'request_header_user_agent',
+        'request_header_user_agent__browser__family',
+        'request_header_user_agent__browser__version_string',
+        'request_header_user_agent__os__family',
+        'request_header_user_agent__os__version_string',
+        'request_header_user_agent__is_mobile'),
+    apache_log_parser.format_time: (
+        'time_received', 'time_received_datetimeobj',
+        'time_received_isoformat', 'time_received_tz_datetimeobj',
+        'time_received_tz_isoformat', 'time_received_utc_datetimeobj',
+        'time_received_utc_isoformat'),
+}
+
+
+@functools.lru_cache(maxsize=8)
+def _parser(fmt):
+    '''INTERNAL: Build the apache_log_parser Parser for a log format.
+    Building the parser compiles the line regex, so it is done once per
+    format rather than once per ApacheLogRecords().
+    '''
+    return apache_log_parser.Parser(fmt)
+
+
+@functools.lru_cache(maxsize=8)
+def _record_class(names):
+    '''INTERNAL: Build the namedtuple class for the raw fields of a format.
+    The records can also be indexed by field name, as the dictionary
+    records are.
+
+    :param names: Tuple of the field names.
+    '''
+    class LogRecord(collections.namedtuple('LogRecord', names)):
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                try:
+                    return getattr(self, key)
+                except AttributeError:
+                    raise KeyError(key) from None
+            return super().__getitem__(key)
+    return LogRecord
+
+
+def _key_fields(parser):
+    '''INTERNAL: Map each key the records of a format can have to the
+    field it is parsed from, according to the format's field definitions.
+
+    :param parser: apache_log_parser Parser for the format.
+    :rtype: Dictionary mapping each key to its field name.
+    '''
+    return {
+        key: name
+        for name, function in parser.functions_to_parse.items()
+        for key in _PARSER_KEYS.get(function, (name,))}
+
 
 class ApacheLogRecords(AbstractRecords):
-    def __init__(self, in_fileobj, fmt=FORMAT_VHOST_COMBINED):
+    '''Records parsed from an Apache log file, as dictionaries.
+
+    If "columns" is given, the records only have those keys, and only the
+    fields needed for them are parsed, skipping the expensive URL and
+    User-Agent parsing if they aren't asked for.  A column the line
+    doesn't produce, such as "request_url_path" for a "-" request line,
+    is None.  Unknown column names raise KeyError.
+
+    Example:
+
+        records = ApacheLogRecords(fp, FORMAT_COMBINED, ['status', 'bytes_tx'])
+        columns = records.to_columns()
+        total = sum(int(x) for x in columns['bytes_tx'])
+
+    If "raw" is true, the records are instead namedtuples of the unparsed
+    field strings, such as "status", "time_received" and
+    "request_first_line", which can also be indexed by field name.  None
+    of the fields are parsed, so this is the fastest way to read the log.
+
+    If "lazy" is true, the records are LazyApacheRecord mappings which
+    parse a field the first time one of its keys is looked up, so only
+    the fields that are used are parsed.
+
+    :param in_fileobj: File to read the log lines from.
+    :param fmt: Apache LogFormat of the lines.
+    :param columns: List of the keys to keep in the records, or None for
+            all of them.
+    :param raw: (bool) Produce namedtuples of the unparsed fields.
+    :param lazy: (bool) Produce records that parse fields on demand.
+    '''
+    def __init__(
+            self, in_fileobj, fmt=FORMAT_VHOST_COMBINED, columns=None,
+            raw=False, lazy=False):
+        if (columns is not None) + raw + lazy > 1:
+            raise ValueError(
+                'Only one of "columns", "raw" and "lazy" can be used')
         self.in_fileobj = in_fileobj
-        self.parser = apache_log_parser.make_parser(fmt)
+        self.columns = None if columns is None else tuple(columns)
+        parser = _parser(fmt)
+        self._regex = parser.log_line_regex
+        self._match = parser.log_line_regex.match
+        self._functions = tuple(
+            (name, _cached(name, function) if name in _CACHED_FIELDS
+             else function)
+            for name, function in parser.functions_to_parse.items())
+        self._quoted = '"' in fmt
+        if columns is not None:
+            key_fields = _key_fields(parser)
+            missing = [x for x in self.columns if x not in key_fields]
+            if missing:
+                raise KeyError('Unknown columns: {!r}'.format(missing))
+            needed = {key_fields[x] for x in self.columns}
+            self._functions = tuple(
+                x for x in self._functions if x[0] in needed)
+        self.parser = self.parse
+        self._raw_names = None
+        if raw:
+            groupindex = parser.log_line_regex.groupindex
+            names = tuple(sorted(groupindex, key=groupindex.get))
+            self._indices = tuple(groupindex[x] for x in names)
+            self._raw_names = names
+            self._make = _record_class(names)._make
+            self.parser = self.parse = self._parse_raw
+        if lazy:
+            functions = dict(self._functions)
+            self._key_functions = {
+                key: (name, functions[name])
+                for key, name in _key_fields(parser).items()}
+            self.parser = self.parse = self._parse_lazy
 
     def __iter__(self):
         return self
@@ -22,4 +164,149 @@ class ApacheLogRecords(AbstractRecords):
         line = self.in_fileobj.readline()
         if not line:
             raise StopIteration
-        return self.parser(line)
+        return self.parse(line)
+
+    def parse(self, line):
+        '''Parse a log line into a dictionary, as apache_log_parser does.
+        The match's groupdict() is built once per line rather than once
+        per field, and lines missing the quotes the format requires are
+        rejected without running the regex.
+
+        :param line: Log line to parse.
+        :rtype: Dictionary of the parsed fields.
+        '''
+        match = None
+        if '"' in line or not self._quoted:
+            match = self._match(line)
+        if match is None:
+            raise apache_log_parser.LineDoesntMatchException(
+                log_line=line, regex=self._regex.pattern)
+
+        groups = match.groupdict()
+        results = {}
+        for name, function in self._functions:
+            results.update(function({name: groups[name]}))
+        if self.columns is None:
+            return results
+        return {column: results.get(column) for column in self.columns}
+
+    def _parse_raw(self, line):
+        '''INTERNAL: parse() for "raw" records.'''
+        match = None
+        if '"' in line or not self._quoted:
+            match = self._match(line)
+        if match is None:
+            raise apache_log_parser.LineDoesntMatchException(
+                log_line=line, regex=self._regex.pattern)
+        return self._make(match.group(*self._indices))
+
+    def _parse_lazy(self, line):
+        '''INTERNAL: parse() for "lazy" records.'''
+        match = None
+        if '"' in line or not self._quoted:
+            match = self._match(line)
+        if match is None:
+            raise apache_log_parser.LineDoesntMatchException(
+                log_line=line, regex=self._regex.pattern)
+
+        return LazyApacheRecord(
+            match.groupdict(), self._functions, self._key_functions)
+
+    def to_columns(self):
+        '''Read the remaining records into a dictionary of lists, one
+        list per key, for aggregating columns.  Not every line has every
+        key, such as the "request_url_*" keys of a "-" request line, and
+        the missing values are None.  For "raw" records, the keys are the
+        field names.
+
+        :rtype: Dictionary mapping each key to the list of its values.
+        '''
+        records = list(self)
+        if self._raw_names is not None:
+            return {
+                name: [record[i] for record in records]
+                for i, name in enumerate(self._raw_names)}
+        if self.columns is not None:
+            columns = self.columns
+        else:
+            columns = dict.fromkeys(
+                key for record in records for key in record)
+        return {
+            column: [record.get(column) for record in records]
+            for column in columns}
+
+
+def _cached(name, function):
+    '''INTERNAL: Wrap a field parsing function with an LRU cache.
+    Log lines from the same second or the same browser share the parse
+    of those fields.
+
+    :param name: Name of the field the function parses.
+    :param function: apache_log_parser function taking "{name: value}".
+    :rtype: Function taking "{name: value}" and returning the parsed
+            values.
+    '''
+    @functools.lru_cache(maxsize=1024)
+    def parse(value):
+        return function({name: value})
+
+    def wrapper(values):
+        return parse(values[name])
+    return wrapper
+
+
+class LazyApacheRecord(collections.abc.Mapping):
+    '''A log record which parses each field on first use.
+    Looking up a key parses the field it comes from, and keeps all of
+    the keys that field produces.  Iterating over the record, or taking
+    its len(), parses all of the fields, as which keys a line has depends
+    on its values: a "-" request line has no "request_url_*" keys.
+    Otherwise it behaves as the read-only dictionary that ApacheLogRecords
+    produces.
+
+    :param groups: groupdict() of the line's match.
+    :param functions: Tuple of the "(name, function)" field parsers.
+    :param key_functions: Dictionary mapping each key the format can
+            produce to the "(name, function)" of the field parser that
+            produces it.
+    :param values: Dictionary of already parsed values.
+    '''
+    __slots__ = ('_groups', '_functions', '_key_functions', '_values')
+
+    def __init__(self, groups, functions, key_functions, values=None):
+        self._groups = groups
+        self._functions = functions
+        self._key_functions = key_functions
+        self._values = {} if values is None else values
+
+    def __getitem__(self, key):
+        values = self._values
+        try:
+            return values[key]
+        except KeyError:
+            pass
+        name, function = self._key_functions[key]
+        #  Every field parser produces the field's own name as a key.
+        if name not in values:
+            values.update(function({name: self._groups[name]}))
+        return values[key]
+
+    def _parse_all(self):
+        '''INTERNAL: Parse the fields not parsed yet.
+
+        :rtype: Dictionary of all the values.
+        '''
+        values = self._values
+        for name, function in self._functions:
+            if name not in values:
+                values.update(function({name: self._groups[name]}))
+        return values
+
+    def __iter__(self):
+        return iter(self._parse_all())
+
+    def __len__(self):
+        return len(self._parse_all())
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, dict(self))
@@ -3,8 +3,9 @@ from . import AbstractRecords
 
 
 class LineRecords(AbstractRecords):
-    def __init__(self, in_fileobj):
+    def __init__(self, in_fileobj, binary=False):
         self.in_fileobj = in_fileobj
+        self.binary = binary
 
     def __iter__(self):
-        return StringIterator(self.in_fileobj)
+        return StringIterator(self.in_fileobj, binary=self.binary)
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# vim: ts=4 sw=4 ai et
+
+import hashlib
+
+
+def _digest(chunks):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk.encode() if isinstance(chunk, str) else chunk)
+    return digest.digest()
+
+
+def assert_stream_equals(test, actual, expected):
+    '''Assert that the concatenated items of "actual" equal "expected".
+    Both sides are compared by SHA-256 digest, so large outputs are not
+    built up into strings.  If they differ, the output is joined and
+    compared with assertEqual() for a readable diff.
+
+    :param test: TestCase making the assertion.
+    :param actual: str or bytes, or an iterable of them.
+    :param expected: str or bytes that "actual" should produce.
+    '''
+    if isinstance(actual, (str, bytes)):
+        actual = [actual]
+    actual = list(actual)
+    if _digest(actual) == _digest([expected]):
+        return
+    test.assertEqual(expected[:0].join(actual), expected)
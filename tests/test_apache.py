@@ -2,6 +2,7 @@
 # vim: ts=4 sw=4 ai et
 
 from unittest import TestCase
+import apache_log_parser
 import spawk
 from spawk.parser.apache_log import ApacheLogRecords, FORMAT_COMBINED
 from io import StringIO
@@ -15,6 +16,11 @@ sample_data = (
 10.1.1.1 - - [27/Jan/2019:17:40:50 -0700] "GET /osm/8/53/97.png HTTP/1.1" 200 22704 "http://osm1.stg.realgo.com/osm/slippymap.html" "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:64.0) Gecko/20100101 Firefox/64.0"
 10.1.1.1 - - [27/Jan/2019:17:40:50 -0700] "GET /osm/8/54/99.png HTTP/1.1" 200 9458 "http://osm1.stg.realgo.com/osm/slippymap.html" "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:64.0) Gecko/20100101 Firefox/64.0"''')
 
+odd_line = (
+    '10.1.1.3 - - [27/Jan/2019:17:41:00 -0700] "-" 408 0 "-" "-"\n')
+mixed_data = (
+    sample_data.split('\n', 1)[0] + '\n' + odd_line + sample_data)
+
 
 class TestApacheLog(TestCase):
     def setUp(self):
@@ -42,4 +48,97 @@ class TestApacheLog(TestCase):
 
         self.assertEqual(self.t.context.bytes_tx, 35223)
 
+    def test_matches_apache_log_parser(self):
+        parse = apache_log_parser.make_parser(FORMAT_COMBINED)
+        expected = [parse(line) for line in sample_data.splitlines()]
+        self.assertEqual(
+            list(ApacheLogRecords(StringIO(sample_data), FORMAT_COMBINED)),
+            expected)
+
+    def test_columns(self):
+        records = ApacheLogRecords(
+            StringIO(sample_data), FORMAT_COMBINED, ['status', 'bytes_tx'])
+        self.assertEqual(next(records), {'status': '200', 'bytes_tx': '467'})
+        columns = records.to_columns()
+        self.assertEqual(
+            columns['status'], ['200', '200', '404', '404', '200', '200'])
+        self.assertEqual(sum(int(x) for x in columns['bytes_tx']), 36224)
+
+    def test_raw(self):
+        records = list(ApacheLogRecords(
+            StringIO(sample_data), FORMAT_COMBINED, raw=True))
+        self.assertEqual(records[3].status, '404')
+        self.assertEqual(records[3]['bytes_tx'], '735')
+        self.assertEqual(
+            records[0].request_first_line, 'GET / HTTP/1.0')
+        with self.assertRaises(KeyError):
+            records[0]['nope']
+
+    def test_raw_to_columns(self):
+        columns = ApacheLogRecords(
+            StringIO(mixed_data), FORMAT_COMBINED, raw=True).to_columns()
+        self.assertEqual(columns['status'][:3], ['200', '408', '200'])
+        self.assertEqual(
+            columns['request_first_line'][:2], ['GET / HTTP/1.0', '-'])
+        self.assertEqual(
+            ApacheLogRecords(StringIO(''), FORMAT_COMBINED, raw=True)
+            .to_columns()['status'], [])
+
+    def test_lazy(self):
+        parse = apache_log_parser.make_parser(FORMAT_COMBINED)
+        expected = [parse(line) for line in sample_data.splitlines()]
+        records = list(ApacheLogRecords(
+            StringIO(sample_data), FORMAT_COMBINED, lazy=True))
+        self.assertEqual(records[4]['status'], '404')
+        self.assertNotIn(
+            'request_header_user_agent__browser__family', records[4]._values)
+        self.assertEqual([dict(x) for x in records], expected)
+        with self.assertRaises(KeyError):
+            records[1]['nope']
+
+    def test_lazy_mixed_lines(self):
+        parse = apache_log_parser.make_parser(FORMAT_COMBINED)
+        for data in (odd_line + sample_data, mixed_data):
+            expected = [parse(line) for line in data.splitlines()]
+            records = list(ApacheLogRecords(
+                StringIO(data), FORMAT_COMBINED, lazy=True))
+            self.assertEqual([dict(x) for x in records], expected)
+            self.assertEqual(
+                records[-1]['request_url_path'], '/osm/8/54/99.png')
+            odd = records[data.splitlines().index(odd_line.strip())]
+            self.assertEqual(len(odd), 23)
+            with self.assertRaises(KeyError):
+                odd['request_url_scheme']
+
+    def test_unknown_column(self):
+        with self.assertRaises(KeyError):
+            ApacheLogRecords(StringIO(sample_data), FORMAT_COMBINED, ['nope'])
+
+    def test_columns_mixed_lines(self):
+        columns = ['status', 'request_url_path']
+        for data in (odd_line + sample_data, mixed_data):
+            records = list(ApacheLogRecords(
+                StringIO(data), FORMAT_COMBINED, columns))
+            self.assertIn(
+                {'status': '408', 'request_url_path': None}, records)
+            self.assertEqual(
+                records[-1],
+                {'status': '200', 'request_url_path': '/osm/8/54/99.png'})
+            self.assertEqual(
+                ApacheLogRecords(
+                    StringIO(data), FORMAT_COMBINED, columns).to_columns(),
+                {column: [x[column] for x in records] for column in columns})
+
+        for lazy in (False, True):
+            columns = ApacheLogRecords(
+                StringIO(mixed_data), FORMAT_COMBINED, lazy=lazy).to_columns()
+            self.assertEqual(
+                columns['request_url_path'][:3], ['/', None, '/'])
+            self.assertEqual(columns['status'][:3], ['200', '408', '200'])
+
+    def test_line_doesnt_match(self):
+        records = ApacheLogRecords(StringIO('no quotes here\n'), FORMAT_COMBINED)
+        with self.assertRaises(apache_log_parser.LineDoesntMatchException):
+            list(records)
+
 #dict_keys(['remote_host', 'remote_logname', 'remote_user', 'time_received', 'time_received_datetimeobj', 'time_received_isoformat', 'time_received_tz_datetimeobj', 'time_received_tz_isoformat', 'time_received_utc_datetimeobj', 'time_received_utc_isoformat', 'request_first_line', 'request_method', 'request_url', 'request_http_ver', 'request_url_scheme', 'request_url_netloc', 'request_url_path', 'request_url_query', 'request_url_fragment', 'request_url_username', 'request_url_password', 'request_url_hostname', 'request_url_port', 'request_url_query_dict', 'request_url_query_list', 'request_url_query_simple_dict', 'status', 'bytes_tx', 'request_header_referer', 'request_header_user_agent', 'request_header_user_agent__browser__family', 'request_header_user_agent__browser__version_string', 'request_header_user_agent__os__family', 'request_header_user_agent__os__version_string', 'request_header_user_agent__is_mobile'])
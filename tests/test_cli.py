@@ -2,6 +2,8 @@
 # vim: ts=4 sw=4 ai et
 
 from unittest import mock, TestCase
+import contextlib
+import io
 from spawk.cli.main import cli
 from click.testing import CliRunner
 
@@ -16,3 +18,66 @@ class TestCliMain(TestCase):
             result = runner.invoke(cli, ['input', 'sample_input', 'upper'])
             self.assertEqual(result.exit_code, 0)
             self.assertEqual(result.output, 'HELLO WORLD!')
+
+    def test_line_buffered(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            with open('sample_input', 'w') as fp:
+                fp.write('Hello\nworld!\n')
+
+            result = runner.invoke(
+                cli, ['--line-buffered', 'input', 'sample_input', 'lower'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.output, 'hello\nworld!\n')
+
+    def test_fused_mappers(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            with open('sample_input', 'w') as fp:
+                fp.write('Hello\nworld!\n')
+
+            result = runner.invoke(cli, [
+                'input', 'sample_input', 'upper', 'lower', 'tee', 'copy',
+                'upper'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.output, 'HELLO\nWORLD!\n')
+            with open('copy', 'r') as fp:
+                self.assertEqual(fp.read(), 'hello\nworld!\n')
+
+    def test_bytes(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            with open('sample_input', 'wb') as fp:
+                fp.write(b'Hello\nworld!\n')
+
+            result = runner.invoke(
+                cli, ['input', '--bytes', 'sample_input', 'upper', 'tee', 'copy'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.output, 'HELLO\nWORLD!\n')
+            with open('copy', 'rb') as fp:
+                self.assertEqual(fp.read(), b'HELLO\nWORLD!\n')
+
+    def test_stdout_without_buffer(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            with open('sample_input', 'w') as fp:
+                fp.write('Hello\nworld\n')
+
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                cli.main(
+                    ['input', 'sample_input', 'upper'], standalone_mode=False)
+                cli.main(
+                    ['input', 'sample_input', 'output'],
+                    standalone_mode=False)
+            self.assertEqual(out.getvalue(), 'HELLO\nWORLD\nHello\nworld\n')
+
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                cli.main(
+                    ['input', '--bytes', 'sample_input', 'upper'],
+                    standalone_mode=False)
+                cli.main(
+                    ['input', '--bytes', 'sample_input', 'output'],
+                    standalone_mode=False)
+            self.assertEqual(out.getvalue(), 'HELLO\nWORLD\nHello\nworld\n')
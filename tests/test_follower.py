@@ -20,15 +20,24 @@ class ReturnList:
 class FakeFile:
     def __init__(self, data):
         self.data = data
+        self.seeks = []
 
-    def read(self, *args):
+    def seek(self, *args):
+        self.seeks.append(args)
+
+    def readinto(self, buf):
         if not self.data:
-            return ''
-        return self.data.pop(0)
+            return 0
+        value = self.data.pop(0)
+        buf[:len(value)] = value
+        return len(value)
 
     def fileno(self):
         return 3
 
+    def close(self):
+        pass
+
 
 class FakeStat:
     def __init__(self, **kwargs):
@@ -39,20 +48,20 @@ class FakeStat:
 read_data = ReturnList([
     FileNotFoundError(),
     FakeFile([
-        'first ',
-        'line\n',
-        'second line\n',
-        'third line\n',
+        b'first ',
+        b'line\n',
+        b'second line\n',
+        b'third line\n',
         ]),
     FakeFile([
-        'fourth line\n',
-        'fifth line\n',
+        b'fourth line\nfif',
+        b'th line\n',
         ]),
     FakeFile([
-        'sixth line\n',
+        b'sixth line\n',
         ]),
     FakeFile([
-        'seventh line\n',
+        b'seventh line\n',
         ]),
     KeyboardInterrupt(),
     ])
@@ -71,12 +80,9 @@ stat_data = ReturnList([
 
 class TestFollower(TestCase):
     def test_follower(self):
-        opener = mock.Mock(side_effect=read_data)
-        stater = mock.Mock(side_effect=stat_data)
-
         lines = []
-        with mock.patch('spawk.input.open', opener) as m_open:  # noqa: W0612
-            with mock.patch('os.stat', stater) as m_stat:     # noqa: W0612
+        with mock.patch('spawk.input.open', read_data) as m_open:  # noqa: W0612
+            with mock.patch('os.stat', stat_data) as m_stat:     # noqa: W0612
                 f = spawk.FileFollower('foo', sleep_time=0.001)
                 for line in f:
                     lines.append(line)
@@ -86,4 +92,46 @@ class TestFollower(TestCase):
         self.assertEqual(
                 stat_data.return_values, [], 'stat_data not fully consumed')
         self.assertEqual(lines[0], 'first line\n')
+        self.assertEqual(lines[4], 'fifth line\n')
         self.assertEqual(len(lines), 7)
+
+    def test_seek_end(self):
+        fake_file = FakeFile([b'new line\n'])
+        opener = mock.Mock(return_value=fake_file)
+        stater = mock.Mock(return_value=FakeStat(st_dev=1, st_ino=1, st_size=2))
+
+        with mock.patch('spawk.input.open', opener) as m_open:  # noqa: W0612
+            with mock.patch('os.stat', stater) as m_stat:     # noqa: W0612
+                f = spawk.FileFollower('foo', sleep_time=0.001, seek_end=True)
+                line = next(iter(f))
+
+        self.assertEqual(line, 'new line\n')
+        self.assertEqual(fake_file.seeks, [(0, 2)])
+
+    def test_inotify_wakeup(self):
+        if spawk.input.inotify_simple is None:
+            self.skipTest('inotify_simple is not installed')
+        import os
+        import tempfile
+        import threading
+        import time
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'log')
+            with open(filename, 'w') as fp:
+                fp.write('first line\n')
+
+            def append():
+                time.sleep(0.2)
+                with open(filename, 'a') as fp:
+                    fp.write('second line\n')
+            writer = threading.Thread(target=append)
+
+            lines = iter(spawk.FileFollower(filename, sleep_time=30))
+            self.assertEqual(next(lines), 'first line\n')
+            started = time.monotonic()
+            writer.start()
+            self.assertEqual(next(lines), 'second line\n')
+            self.assertLess(time.monotonic() - started, 10)
+            lines.close()
+            writer.join()
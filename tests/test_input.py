@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# vim: ts=4 sw=4 ai et
+
+from unittest import TestCase
+import spawk
+from io import StringIO, BytesIO
+import mmap
+import os
+import tempfile
+
+sample_data = '''first line
+second line\x0cwith a form feed
+
+fourth line without a newline'''
+
+
+class TestBlockLineReader(TestCase):
+    def test_matches_file_iteration(self):
+        for bufsize in (1, 3, 7, 1024):
+            lines = list(spawk.BlockLineReader(StringIO(sample_data), bufsize))
+            self.assertEqual(lines, list(StringIO(sample_data)))
+
+    def test_bytes(self):
+        data = sample_data.encode() + b'\n'
+        lines = list(spawk.BlockLineReader(BytesIO(data), 5))
+        self.assertEqual(lines, list(BytesIO(data)))
+
+    def test_spawk_input(self):
+        t = spawk.Spawk(spawk.BlockLineReader(StringIO(sample_data), 4))
+        self.assertEqual(
+            [line.line_number for line in t.grep('line')], [1, 2, 4])
+
+    def test_pipe(self):
+        read_fd, write_fd = os.pipe()
+        with open(read_fd, 'rb') as reader, open(write_fd, 'wb') as writer:
+            writer.write(b'first line\nsecond ')
+            writer.flush()
+            lines = iter(spawk.Spawk(reader, binary=True))
+            #  The lines written so far are produced without waiting for
+            #  a full block or the end of the input.
+            self.assertEqual(next(lines), b'first line\n')
+            writer.write(b'line\n')
+            writer.close()
+            self.assertEqual(list(lines), [b'second line\n'])
+
+
+class TestMmapLineIterator(TestCase):
+    def test_matches_file_iteration(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'sample')
+            for data in (sample_data, sample_data + '\n', ''):
+                with open(filename, 'w') as fp:
+                    fp.write(data)
+                with open(filename, 'r') as fp:
+                    expected = list(fp)
+                self.assertEqual(
+                    list(spawk.MmapLineIterator(filename)), expected)
+
+    def test_numpy_blocks(self):
+        if spawk.input.numpy is None:
+            self.skipTest('numpy is not installed')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'sample')
+            with open(filename, 'w') as fp:
+                fp.write(sample_data)
+            with open(filename, 'r') as fp:
+                expected = list(fp)
+            iterator = spawk.MmapLineIterator(filename)
+            with open(filename, 'rb') as fp:
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for blocksize in (1, 5, 1024):
+                        self.assertEqual(
+                            list(iterator._split_numpy(mm, blocksize)),
+                            expected)
+
+    def test_spawk_filename(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'sample')
+            with open(filename, 'w') as fp:
+                fp.write(sample_data)
+            t = spawk.Spawk(filename).grep('line')
+            self.assertEqual([line.line_number for line in t], [1, 2, 4])
+            t = spawk.Spawk(filename, binary=True).grep('line')
+            self.assertEqual(list(t)[0], b'first line\n')
+
+    def test_from_path_grep(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'sample')
+            with open(filename, 'w') as fp:
+                fp.write(sample_data + '\nfifth l\xefne\n')
+            for patterns, binary in (
+                    (('line', 'ne\n'), False), (('l\xefne',), False),
+                    ((r'\bl\w+e', r'^$'), True), ((r'd\s',), True)):
+                t = spawk.Spawk.from_path(filename, binary=binary)
+                expected = [
+                    (x.line_number, x) for x in spawk.Spawk(
+                        spawk.MmapLineIterator(
+                            filename, None if binary else 'utf-8'),
+                        binary=binary).split().grep(*patterns)]
+                self.assertEqual(
+                    [(x.line_number, x) for x in t.grep(*patterns)],
+                    expected, patterns)
+            t = spawk.Spawk.from_path(filename).grep('line')
+            self.assertEqual(next(iter(t)), 'first line\n')
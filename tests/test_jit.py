@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# vim: ts=4 sw=4 ai et
+
+from unittest import TestCase
+from spawk.jit import count_words, _count_words
+
+
+class TestCountWords(TestCase):
+    def test_count_words(self):
+        for data in [b'', b'  ', b'one', b' one two\tthree\n', b'a\x0bb\x0cc\r\n']:
+            self.assertEqual(count_words(data), len(data.split()))
+            self.assertEqual(_count_words(data), len(data.split()))
+
+    def test_count_words_str(self):
+        self.assertEqual(count_words('hello big world\n'), 3)
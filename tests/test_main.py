@@ -2,9 +2,14 @@
 # vim: ts=4 sw=4 ai et
 
 from unittest import mock, TestCase
+import contextlib
 import spawk
-from io import StringIO
+from io import BytesIO, StringIO
+import os
 import sys
+import tempfile
+
+from ._util import assert_stream_equals
 
 sample_data = '''Lorem ipsum dolor sit amet, consectetur
 adipiscing elit, sed do eiusmod tempor
@@ -39,7 +44,7 @@ class TestMainWithSample(TestCase):
         self.t = spawk.Spawk(fileobj)
 
     def test_basic(self):
-        self.assertEqual(''.join(self.t), sample_data)
+        assert_stream_equals(self, self.t, sample_data)
 
     def test_grep_singlematch(self):
         self.t.grep('anim')
@@ -60,6 +65,85 @@ class TestMainWithSample(TestCase):
                 'pariatur. Excepteur sint occaecat\n'
                 'qui officia deserunt mollit anim id\n')
 
+    def test_grep_multiexpr_same_line(self):
+        self.t.grep('anim', 'mollit')
+        self.assertEqual(
+                ''.join(self.t), 'qui officia deserunt mollit anim id\n')
+
+    def test_grep_literal_and_regex(self):
+        self.t.grep('mollit', 'Ut', r'^c\w+at\.')
+        self.assertEqual(
+                [line.line_number for line in self.t], [4, 7, 12])
+
+    def test_grep_backreference(self):
+        self.t.grep(r'(\w)ia', r'(l)\1')
+        self.assertEqual(
+                [line.line_number for line in self.t], [4, 5, 9, 10, 12])
+
+    def test_grep_no_patterns(self):
+        self.assertEqual(list(self.t.grep()), [])
+        t = spawk.Spawk(StringIO(sample_data)).split().grep()
+        self.assertEqual(list(t), [])
+        self.assertEqual(
+                list(spawk.Spawk(StringIO(sample_data)).grep_batched()), [])
+
+    def test_grep_required_literal(self):
+        self.t.grep(r'm(ol)+lit\s(\w+)')
+        self.assertEqual(
+                ''.join(self.t), 'qui officia deserunt mollit anim id\n')
+
+    def test_required_literal(self):
+        from spawk.internal import _required_literal
+        self.assertEqual(_required_literal(r'^GET /\S+'), 'GET /')
+        self.assertEqual(_required_literal(r'x(ab)+c(de)?'), 'ab')
+        self.assertEqual(_required_literal(b'foo.bar'), b'foo')
+        self.assertIsNone(_required_literal(r'(?i)abc'))
+        self.assertIsNone(_required_literal(r'ab|cd'))
+        self.assertIsNone(_required_literal(r'a\d+'))
+
+    def test_literal_search(self):
+        import re
+        from spawk.internal import _literal_pattern, _search
+        self.assertEqual(_literal_pattern(r'\);'), ');')
+        self.assertEqual(_literal_pattern(b'CREATE TABLE'), b'CREATE TABLE')
+        self.assertIsNone(_literal_pattern(r'a.b'))
+        self.assertIsNone(_literal_pattern(r'(?i)abc'))
+        for line in ('create table CREATE TABLE x();\n', 'nothing\n'):
+            for pattern in ('CREATE TABLE', r'\(\);'):
+                expected = re.search(pattern, line)
+                m = _search(pattern)(line)
+                if expected is None:
+                    self.assertIsNone(m)
+                    continue
+                self.assertEqual(m.group(), expected.group())
+                self.assertEqual(m[0], expected[0])
+                self.assertEqual(m.span(), expected.span())
+                self.assertEqual(m.groups(), expected.groups())
+                self.assertEqual(m.re.pattern, pattern)
+                with self.assertRaises(IndexError):
+                    m.group(1)
+
+    def test_grep_batched(self):
+        self.t.grep_batched('anim', 'occaecat', batch=4)
+        self.assertEqual(
+                [line.line_number for line in self.t], [10, 12])
+
+    def test_grep_buffer_matches_lines(self):
+        data = sample_data + 'no newline at the end\t'
+        for patterns in [
+                ('lit',), ('^a', 'um$'), (r'\s\w+$',), (r'[^a-z]i',),
+                (r'd\s', r'o\W'), (r'$',), (r'^',), (r't\s*$',),
+                (r'(\w)\1',), (r'\Aq',), ('laborum.\n',)]:
+            expected = [
+                (x.line_number, x) for x in spawk.Spawk(
+                    line for line in StringIO(data)).grep(*patterns)]
+            for wrap, binary in ((StringIO, False), (BytesIO, True)):
+                fileobj = wrap(data.encode() if binary else data)
+                t = spawk.Spawk(fileobj, binary=binary).grep(*patterns)
+                self.assertEqual(
+                    [(x.line_number, x.decode() if binary else x) for x in t],
+                    expected, patterns)
+
     def test_grep_linenumber(self):
         self.t.grep('anim')
         self.assertEqual(list(self.t)[0].line_number, 12)
@@ -70,6 +154,26 @@ class TestMainWithSample(TestCase):
         self.assertEqual(line.fields[4], 'anim')
         self.assertEqual(len(line.fields), 6)
 
+    def test_field(self):
+        self.t.grep('anim').split(' ', 2)
+        line = list(self.t)[0]
+        self.assertEqual(line.field(1), 'officia')
+        self.assertEqual(line.field(2), 'deserunt mollit anim id\n')
+        self.assertEqual(line.field(-1), 'deserunt mollit anim id\n')
+        self.assertEqual(len(line.fields), 3)
+
+    def test_resplit(self):
+        self.t.split(',').grep('anim').split()
+        line = list(self.t)[0]
+        self.assertEqual(line.field(4), 'anim')
+        self.assertEqual(len(line.fields), 6)
+
+    def test_fields_without_split(self):
+        self.t.grep('anim')
+        line = list(self.t)[0]
+        self.assertEqual(line.fields[4], 'anim')
+        self.assertEqual(len(line.fields), 6)
+
     def test_program(self):
         @self.t.begin()
         def begin(context):
@@ -99,6 +203,72 @@ class TestMainWithSample(TestCase):
 
         self.assertEqual(self.t.context.words, 13)
 
+    def test_driver_code_shared(self):
+        from spawk.internal import _compile_driver_source
+        _compile_driver_source.cache_clear()
+        for _ in range(2):
+            t = spawk.Spawk(StringIO(sample_data))
+            t.context.words = 0
+
+            @t.pattern(r'anim')
+            def line(context, line):
+                context.words += 1
+            t.run()
+            self.assertEqual(t.context.words, 1)
+        self.assertEqual(_compile_driver_source.cache_info().hits, 1)
+
+    def test_modified_by_pattern(self):
+        self.t.context.data = []
+
+        @self.t.pattern(r'(\w+) anim')
+        def replace(context, line, m):
+            return m.group(1)
+
+        @self.t.eval('line == "mollit"')
+        def check(context, line):
+            context.data.append(line)
+        self.t.run()
+
+        self.assertEqual(self.t.context.data, ['mollit'])
+
+
+class TestBinary(TestCase):
+    def setUp(self):
+        self.t = spawk.Spawk(BytesIO(sample_data.encode()), binary=True)
+
+    def test_grep(self):
+        self.t.grep('anim', r'occ\w+')
+        lines = list(self.t)
+        self.assertEqual(
+            lines, [b'pariatur. Excepteur sint occaecat\n',
+                    b'qui officia deserunt mollit anim id\n'])
+        self.assertEqual(lines[1].line_number, 12)
+        self.assertEqual(lines[1].fields[4], b'anim')
+
+    def test_pattern(self):
+        self.t.context.data = b''
+
+        @self.t.pattern(r'(\w+) anim')
+        def line(context, line, m):
+            context.data += m.group(1)
+        self.t.run()
+
+        self.assertEqual(self.t.context.data, b'mollit')
+
+    def test_stdout_without_buffer(self):
+        out = StringIO()
+        with contextlib.redirect_stdout(out):
+            self.t.pattern('anim')()
+            self.t.run()
+            t = spawk.Spawk(
+                BytesIO(sample_data.encode()), binary=True, buffered=True)
+            t.pattern('occaecat')()
+            t.run()
+        self.assertEqual(
+            out.getvalue(),
+            'qui officia deserunt mollit anim id\n'
+            'pariatur. Excepteur sint occaecat\n')
+
 
 class TestMainWithSampleAndContextData(TestCase):
     def setUp(self):
@@ -117,6 +287,61 @@ class TestMainWithSampleAndContextData(TestCase):
                 'pariatur. Excepteur sint occaecat\n'
                 'qui officia deserunt mollit anim id\n')
 
+    def test_data_stays_str(self):
+        @self.t.every()
+        def line(context, line):
+            if line.line_number == 1:
+                self.assertIsInstance(context.data, str)
+                self.assertFalse(context.data)
+            context.data += line
+            if line.line_number == 2:
+                self.assertEqual(len(context.data), 79)
+                self.assertTrue(context.data.endswith('tempor\n'))
+        self.t.run()
+
+        self.assertIsInstance(self.t.context.data, str)
+        self.assertEqual(self.t.context.data, sample_data)
+
+    def test_string_sink(self):
+        self.t.context.lines = spawk.StringSink()
+
+        @self.t.pattern(r'lit')
+        def line(context, line):
+            context.lines += line
+        self.t.run()
+
+        self.assertIsInstance(self.t.context.lines, spawk.StringSink)
+        self.assertEqual(len(self.t.context.lines), 3)
+        self.assertEqual(
+                str(self.t.context.lines),
+                'adipiscing elit, sed do eiusmod tempor\nin reprehenderit in '
+                'voluptate velit\nqui officia deserunt mollit anim id\n')
+
+    def test_pattern_match_argument(self):
+        @self.t.pattern(r'(\w+) anim')
+        def line(context, line, m):
+            context.data += m.group(1)
+        self.t.run()
+
+        self.assertEqual(''.join(self.t.context.data), 'mollit')
+        self.assertFalse(hasattr(self.t.context, 'regex'))
+
+    def test_literal_pattern(self):
+        @self.t.pattern(r'mollit')
+        def line(context, line):
+            context.data += '%d %s %d' % (
+                line.line_number, context.regex.group(), context.regex.start())
+        self.t.run()
+        self.assertEqual(''.join(self.t.context.data), '12 mollit 21')
+
+    def test_regex_set_for_indirect_use(self):
+        @self.t.pattern(r'(\w+) anim')
+        def line(context, line):
+            context.data.append(getattr(context, 're' + 'gex').group(1))
+        self.t.context.data = []
+        self.t.run()
+        self.assertEqual(self.t.context.data, ['mollit'])
+
     def test_multi_pattern(self):
         @self.t.pattern(r'anim')
         @self.t.pattern(r'occaecat')
@@ -129,6 +354,84 @@ class TestMainWithSampleAndContextData(TestCase):
                 'pariatur. Excepteur sint occaecat\n'
                 'qui officia deserunt mollit anim id\n')
 
+    def test_pattern_run(self):
+        self.t.context.data = []
+
+        @self.t.pattern(r'anim')
+        def first(context, line):
+            context.data.append(('anim', line.line_number))
+
+        @self.t.pattern(r'(\w+)it\b')
+        def second(context, line, m):
+            context.data.append((m.group(1), line.line_number))
+            if line.line_number == 8:
+                return spawk.Continue
+
+        @self.t.pattern(r'vel')
+        def third(context, line):
+            context.data.append(('vel', line.line_number))
+        self.t.run()
+
+        self.assertEqual(
+                self.t.context.data,
+                [('s', 1), ('el', 2), ('reprehender', 8), ('anim', 12),
+                 ('moll', 12)])
+
+    def test_fused_pipeline(self):
+        t = spawk.Spawk(line for line in StringIO(sample_data))
+        t.grep('lit').split().grep('in', r'e\w+d').split('i', 1)
+        t.context.data = []
+
+        @t.every()
+        def every(context, line):
+            context.data.append((line.line_number, line.field(1)))
+        t.run()
+
+        self.assertEqual(
+                t.context.data,
+                [(2, 'piscing elit, sed do eiusmod tempor\n'),
+                 (8, 'n reprehenderit in voluptate velit\n')])
+
+    def test_fused_default_split(self):
+        whitespace = ['adipiscing', 'elit,']
+        comma = ['adipiscing elit', ' sed do eiusmod tempor\n']
+        for splits, expected in (
+                ((), whitespace), ((',',), comma),
+                ((',', None), whitespace), ((None, ','), comma)):
+            t = spawk.Spawk(line for line in StringIO(sample_data))
+            t.grep('adipiscing').split()
+            for sep in splits:
+                t.split(sep)
+            t.context.data = []
+
+            @t.every()
+            def every(context, line):
+                context.data.append(line.fields[:2])
+            t.run()
+            self.assertEqual(t.context.data, [expected], splits)
+
+    def test_pattern_after_replacement(self):
+        self.t.context.data = []
+
+        @self.t.pattern(r'anim')
+        def first(context, line):
+            context.data.append(line.line_number)
+
+        @self.t.every()
+        def replace(context, line):
+            if line.line_number == 1:
+                return 'occaecat replaced'
+
+        @self.t.pattern(r'occaecat')
+        def second(context, line):
+            context.data.append(line)
+        self.t.run()
+
+        self.assertEqual(
+                self.t.context.data,
+                ['occaecat replaced', 'pariatur. Excepteur sint occaecat\n',
+                 12])
+
     def test_multi_pattern_range(self):
         @self.t.pattern(r'anim')
         @self.t.range(r'aliqua', r'consequat')
@@ -180,6 +483,49 @@ class TestMainWithSampleAndContextData(TestCase):
                 ''.join(self.t.context.data),
                 'aliqua. Ut enim ad minim veniam,\n')
 
+    def test_range_searches(self):
+        import re
+        searched = []
+
+        class Counting:
+            def __init__(self, pattern):
+                self.pattern = pattern
+                self.rx = re.compile(pattern)
+
+            def search(self, line):
+                searched.append((self.pattern, line.line_number))
+                return self.rx.search(line)
+
+        def search(pattern):
+            return Counting(pattern).search
+
+        with mock.patch('spawk.engine._search', search):
+            @self.t.range(r'aliqua', r'consequat')
+            def line(context, line):
+                pass
+        self.t.run()
+
+        #  The start is only searched for outside the range, the end only
+        #  inside it.
+        self.assertEqual(
+                searched,
+                [('aliqua', 1), ('aliqua', 2), ('aliqua', 3), ('aliqua', 4),
+                 ('consequat', 4), ('consequat', 5), ('consequat', 6),
+                 ('consequat', 7)] +
+                [('aliqua', n) for n in range(8, 14)])
+
+    def test_overlapping_ranges(self):
+        @self.t.range(r'aliqua', r'consequat')
+        def outer(context, line):
+            context.data += '%d ' % context.range.line_number
+
+        @self.t.range(r'quis', r'laboris')
+        def inner(context, line):
+            context.data += '%d ' % context.range.line_number
+        self.t.run()
+
+        self.assertEqual(''.join(self.t.context.data), '1 2 1 3 2 4 ')
+
     def test_grep_and_pattern(self):
         self.t.grep(r'^a')
 
@@ -208,6 +554,29 @@ class TestMainWithSampleAndContextData(TestCase):
                     ''.join(self.t.context.data),
                     'esse cillum dolore eu fugiat nulla\n')
 
+    def test_buffered_print(self):
+        t = spawk.Spawk(StringIO(sample_data), buffered=True)
+        with mock.patch('sys.stdout.write') as mock_write:
+            t.pattern(r'(anim|occaecat)')()
+            t.eval('line.startswith("est")')()
+            t.run()
+
+            mock_write.assert_called_once_with(
+                    'pariatur. Excepteur sint occaecat\n'
+                    'qui officia deserunt mollit anim id\n'
+                    'est laborum.\n')
+
+    def test_buffered_print_blocks(self):
+        t = spawk.Spawk(StringIO(sample_data * 2000), buffered=True)
+        with mock.patch('sys.stdout.write') as mock_write:
+            t.pattern(r'anim')()
+            t.run()
+
+            self.assertEqual(mock_write.call_count, 2)
+            self.assertEqual(
+                    ''.join(x[0][0] for x in mock_write.call_args_list),
+                    'qui officia deserunt mollit anim id\n' * 2000)
+
     def test_eval(self):
         self.t.split()
 
@@ -220,6 +589,151 @@ class TestMainWithSampleAndContextData(TestCase):
                 ''.join(self.t.context.data),
                 'aliqua. Ut enim ad minim veniam,\n')
 
+    def test_eval_context_and_builtins(self):
+        self.t.context.minimum = 6
+
+        @self.t.eval('len(line.split()) > minimum')
+        def line(context, line):
+            context.data += line
+        self.t.run()
+
+        self.assertEqual(
+                ''.join(self.t.context.data),
+                'laboris nisi ut aliquip ex ea commodo\n')
+
+    def test_eval_context_shadows_builtin(self):
+        self.t.context.len = lambda x: 0
+
+        @self.t.eval('len(line) == 0')
+        def line(context, line):
+            context.data += line
+        self.t.run()
+
+        self.assertEqual(''.join(self.t.context.data), sample_data)
+
+    def test_eval_predicate_cached(self):
+        from spawk.internal import _compile_predicate
+        self.assertIs(
+            _compile_predicate('line.fields[0] == "aliqua."'),
+            _compile_predicate('line.fields[0] == "aliqua."'))
+
+    def test_eval_comprehension(self):
+        self.t.context.words = ['anim', 'occaecat']
+
+        @self.t.eval('any(w in line for w in words)')
+        def line(context, line):
+            context.data += line
+        self.t.run()
+
+        self.assertEqual(
+                ''.join(self.t.context.data),
+                'pariatur. Excepteur sint occaecat\n'
+                'qui officia deserunt mollit anim id\n')
+
+    def test_eval_assignment_expression(self):
+        self.t.context.count = 0
+
+        @self.t.eval('(count := count + 1) == 12')
+        def line(context, line):
+            context.data += line
+        self.t.run()
+
+        self.assertEqual(self.t.context.count, 13)
+        self.assertFalse(hasattr(self.t.context, 'line'))
+        self.assertEqual(
+                ''.join(self.t.context.data),
+                'qui officia deserunt mollit anim id\n')
+
+    def test_eval_names(self):
+        self.t.context.y = [1, 2]
+        self.t.context.x = 1
+
+        @self.t.eval(
+                're.search("^est", line) and x > 0 and [x for x in y] '
+                'and [y for y in y]')
+        def line(context, line):
+            context.data += line
+        self.t.run()
+        self.assertEqual(self.t.context.data, 'est laborum.\n')
+
+        t = spawk.Spawk(StringIO(sample_data))
+        t.eval('nope')()
+        with self.assertRaises(NameError):
+            t.run()
+
+    def test_eval_assignment_slot(self):
+        self.t.context.data = 0
+
+        @self.t.eval('(data := data + 1) > 13')
+        def line(context, line):
+            pass
+        self.t.run()
+
+        self.assertEqual(self.t.context.data, 13)
+        self.assertFalse(hasattr(self.t.context, 'line'))
+
+    def test_context_slots(self):
+        context = spawk.Context()
+        self.assertFalse(hasattr(context, 'data'))
+        context.data = 1
+        context.other = 2
+        self.assertEqual(context.__dict__, {'other': 2})
+        self.assertEqual((context.data, context.other), (1, 2))
+
+
+class TestRunParallel(TestCase):
+    def test_grep_and_pattern(self):
+        t = spawk.Spawk(StringIO(sample_data))
+        t.grep('a', 'e').split().grep(r'^[a-q]')
+        t.context.data = []
+
+        @t.pattern(r'(\w+) anim')
+        def line(context, line, m):
+            context.data.append((line.line_number, line.fields[0], m.group(1)))
+
+        @t.every()
+        def every(context, line):
+            context.data.append(line.line_number)
+        t.run_parallel(workers=2, chunksize=100)
+
+        self.assertEqual(
+            t.context.data,
+            [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, (12, 'qui', 'mollit'), 12, 13])
+
+    def test_mapped_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'sample')
+            with open(filename, 'w') as fp:
+                fp.write(sample_data + 'no newline at the end')
+            for binary in (False, True):
+                expected = [
+                    (x.line_number, x) for x in spawk.Spawk(
+                        filename, binary=binary).split().grep('e', r'^[a-q]')]
+                t = spawk.Spawk.from_path(filename, binary=binary)
+                t.grep('e', r'^[a-q]').split()
+                t.context.data = []
+
+                @t.every()
+                def every(context, line):
+                    context.data.append((line.line_number, line))
+                t.run_parallel(workers=2, chunksize=50)
+
+                self.assertEqual(t.context.data, expected)
+                self.assertEqual(t.context.data[-1][0], 14)
+
+    def test_fallback(self):
+        t = spawk.Spawk(StringIO(sample_data))
+        t.input = (line for line in t.input if line.line_number < 3)
+        t.grep('a')
+        t.context.data = []
+
+        @t.every()
+        def every(context, line):
+            context.data.append(line.line_number)
+        t.run_parallel(workers=2)
+
+        self.assertEqual(t.context.data, [1, 2])
+
 
 class TestContinueWithSample(TestCase):
     def setUp(self):
@@ -273,6 +787,20 @@ class TestRangeSQL(TestCase):
                 '   );\n'
                 'CREATE TABLE bar ( length INT );\n')
 
+    def test_range_object_reused(self):
+        ranges = []
+
+        @self.t.range(r'CREATE TABLE', r'\);')
+        def line(context, line):
+            ranges.append((context.range, context.range.line_number))
+        self.t.run()
+
+        self.assertEqual([x[1] for x in ranges], [1, 2, 3, 4, 1])
+        self.assertTrue(all(x[0] is ranges[0][0] for x in ranges))
+        self.assertIsInstance(ranges[0][0], spawk.objects.Range)
+        self.assertIs(self.t.context.range, ranges[0][0])
+        self.assertTrue(self.t.context.range.is_last_line)
+
 
 class TestStdin(TestCase):
     def setUp(self):
@@ -290,5 +818,53 @@ class TestStdin(TestCase):
             context.data += line
         self.t.run()
 
+        assert_stream_equals(self, self.t.context.data, sample_data)
+
+
+class TestRegexBackend(TestCase):
+    def test_unknown_backend(self):
+        with mock.patch.dict('os.environ', {'SPAWK_REGEX_BACKEND': 'nope'}):
+            with self.assertRaises(ValueError):
+                list(spawk.Spawk(StringIO(sample_data)).grep('an.m'))
+
+    def test_compile_cached(self):
+        from spawk.internal import _compile
+        self.assertIs(_compile(r'(a)nim'), _compile(r'(a)nim'))
+
+    def test_regex_module_backend(self):
+        from spawk.internal import regex
+        if regex is None:
+            self.skipTest('regex is not installed')
+        t = spawk.Spawk(StringIO(sample_data), regex_backend='regex')
+        t.grep(r'(a)nim\b', r'(?<=ea )c\w+')
         self.assertEqual(
-                ''.join(self.t.context.data), sample_data)
+            [line.line_number for line in t], [6, 12])
+        self.assertIs(
+            type(spawk.internal._compile_cached(r'\d', 'regex')),
+            type(regex.compile(r'\d')))
+
+    def test_grep_predicate_cached(self):
+        from spawk.internal import _grep_predicate
+        self.assertIs(
+            _grep_predicate(['anim', r'o\w+t']),
+            _grep_predicate(('anim', r'o\w+t')))
+
+    def test_auto_backend(self):
+        with mock.patch.dict('os.environ', {'SPAWK_REGEX_BACKEND': 'auto'}):
+            t = spawk.Spawk(StringIO(sample_data)).grep(r'(a)nim\b')
+            self.assertEqual(
+                ''.join(t), 'qui officia deserunt mollit anim id\n')
+
+    def test_instance_backend(self):
+        with self.assertRaises(ValueError):
+            spawk.Spawk(StringIO(sample_data), regex_backend='nope')
+        with mock.patch.dict('os.environ', {'SPAWK_REGEX_BACKEND': 'nope'}):
+            t = spawk.Spawk(StringIO(sample_data), regex_backend='auto')
+            t.grep(r'(a)nim\b', r'^\w+ \w+ \w+$').split()
+            t.context.data = []
+
+            @t.pattern(r'(\w+)it\b')
+            def line(context, line, m):
+                context.data.append((line.line_number, m.group(1)))
+            t.run()
+        self.assertEqual(t.context.data, [(12, 'moll')])